@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+偵測範圍（area of interest）
+bbox 或 GeoJSON 多邊形 -> 與它相交的圖磚、判斷點是否在範圍內；
+只下載/偵測範圍碰到的圖磚，而不是整個八仙段
+"""
+
+import json
+import math
+
+import numpy as np
+
+from geo import lon_lat_to_tile_xy, tile_xy_to_lon_lat
+
+# 判斷圖磚中心點是否在範圍內時，一批最多幾個「點 x 頂點」（contains 的暫存陣列大小）
+CONTAINS_BATCH = 1 << 22
+
+
+class Area:
+    """一個或多個多邊形（每個多邊形是 [外環, 洞...]，環為經緯度 (N, 2) 陣列）"""
+
+    def __init__(self, polygons):
+        self.polygons = []
+        for rings in polygons:
+            rings = [np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings]
+            if not rings or len(rings[0]) < 3:
+                raise ValueError("polygon needs at least 3 points")
+            if not all(np.isfinite(r).all() for r in rings):
+                raise ValueError("coordinates must be finite")
+            self.polygons.append(rings)
+        if not self.polygons:
+            raise ValueError("empty area")
+        allpts = np.vstack([p[0] for p in self.polygons])
+        self.bounds = (*allpts.min(axis=0), *allpts.max(axis=0))
+
+    @classmethod
+    def from_bbox(cls, min_lon, min_lat, max_lon, max_lat):
+        if not (min_lon < max_lon and min_lat < max_lat):
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        ring = [(min_lon, min_lat), (max_lon, min_lat), (max_lon, max_lat),
+                (min_lon, max_lat), (min_lon, min_lat)]
+        return cls([[ring]])
+
+    @classmethod
+    def parse_bbox(cls, text):
+        """'min_lon,min_lat,max_lon,max_lat'"""
+        try:
+            values = [float(v) for v in text.split(",")]
+        except ValueError:
+            raise ValueError("bbox must be four numbers")
+        if len(values) != 4:
+            raise ValueError("bbox must be four numbers")
+        return cls.from_bbox(*values)
+
+    @classmethod
+    def from_geojson(cls, obj):
+        """Polygon / MultiPolygon geometry、Feature 或 FeatureCollection"""
+        if isinstance(obj, str):
+            obj = json.loads(obj)
+        kind = obj.get("type")
+        if kind == "FeatureCollection":
+            polygons = []
+            for f in obj.get("features", []):
+                polygons.extend(cls.from_geojson(f).polygons)
+            return cls(polygons)
+        if kind == "Feature":
+            return cls.from_geojson(obj.get("geometry") or {})
+        if kind == "Polygon":
+            return cls([obj["coordinates"]])
+        if kind == "MultiPolygon":
+            return cls(obj["coordinates"])
+        raise ValueError(f"unsupported GeoJSON type: {kind}")
+
+    @classmethod
+    def from_request_args(cls, args, body=None):
+        """
+        HTTP 查詢的範圍：args 的 bbox=min_lon,min_lat,max_lon,max_lat 或 polygon=<GeoJSON>，
+        否則是 body（已解析的 GeoJSON）；都沒有時回傳 None，格式錯誤一律是 ValueError
+        """
+        try:
+            if args.get("bbox"):
+                return cls.parse_bbox(args["bbox"])
+            if args.get("polygon"):
+                return cls.from_geojson(args["polygon"])
+            if body:
+                return cls.from_geojson(body)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"invalid GeoJSON: {e}")
+        return None
+
+    def contains(self, points):
+        """points (N, 2) 經緯度是否在範圍內（even-odd，洞不算）"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        px, py = points[:, 0:1], points[:, 1:2]
+        inside = np.zeros(len(points), dtype=bool)
+        for rings in self.polygons:
+            crossings = np.zeros(len(points), dtype=bool)
+            for ring in rings:
+                x0, y0 = ring[:, 0], ring[:, 1]
+                x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+                straddle = (y0 > py) != (y1 > py)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    xcross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+                crossings ^= (np.count_nonzero(straddle & (px < xcross), axis=1) % 2).astype(bool)
+            inside |= crossings
+        return inside
+
+    def _tile_ranges(self, zoom):
+        """每個多邊形外框涵蓋的圖磚範圍 (min_x, min_y, max_x, max_y)"""
+        ranges = []
+        for rings in self.polygons:
+            # 超出 Web Mercator 範圍（例如緯度接近 ±90）的部分沒有圖磚
+            outer = np.clip(lon_lat_to_tile_xy(rings[0], zoom), 0, 2 ** zoom - 1)
+            min_x, min_y = np.floor(outer.min(axis=0)).astype(int).tolist()
+            max_x, max_y = np.floor(outer.max(axis=0)).astype(int).tolist()
+            ranges.append((min_x, min_y, max_x, max_y))
+        return ranges
+
+    def tile_count_bound(self, zoom):
+        """圖磚數的上限（各多邊形外框的圖磚數加總），只看外框，不用列舉圖磚"""
+        return sum((max_x - min_x + 1) * (max_y - min_y + 1)
+                   for min_x, min_y, max_x, max_y in self._tile_ranges(zoom))
+
+    def tiles(self, zoom, max_tiles=None):
+        """
+        與範圍相交的圖磚 [(x, y), ...]，依列、行排序
+        max_tiles: 外框的圖磚數超過這個值就 ValueError（先估算，不列舉）
+        """
+        if max_tiles is not None:
+            count = self.tile_count_bound(zoom)
+            if count > max_tiles:
+                raise ValueError(f"area covers up to {count} tiles, at most {max_tiles} allowed")
+        found = set()
+        for rings, (min_x, min_y, max_x, max_y) in zip(self.polygons, self._tile_ranges(zoom)):
+            outer = lon_lat_to_tile_xy(rings[0], zoom)
+            # 1. 頂點所在的圖磚（範圍整個落在一張圖磚內時）
+            found.update(map(tuple, np.floor(outer).astype(int).tolist()))
+            # 2. 邊經過的圖磚：在與格線的交點切段，取每段中點
+            for (x0, y0), (x1, y1) in zip(outer, np.roll(outer, -1, axis=0)):
+                ts = [0.0, 1.0]
+                for a, b in ((x0, x1), (y0, y1)):
+                    if a != b:
+                        lo, hi = sorted((a, b))
+                        ks = np.arange(math.ceil(lo), math.floor(hi) + 1)
+                        ts.extend(((ks - a) / (b - a)).tolist())
+                ts = np.unique(np.clip(ts, 0.0, 1.0))
+                mids = (ts[:-1] + ts[1:]) / 2
+                xs = np.floor(x0 + mids * (x1 - x0)).astype(int)
+                ys = np.floor(y0 + mids * (y1 - y0)).astype(int)
+                found.update(zip(xs.tolist(), ys.tolist()))
+            # 3. 完全在範圍內的圖磚：中心點在多邊形內；分批處理幾列，暫存陣列大小固定
+            polygon = Area([rings])
+            cols = np.arange(min_x, max_x + 1)
+            vertices = sum(len(r) for r in rings)
+            step = max(1, CONTAINS_BATCH // (len(cols) * vertices))
+            for row in range(min_y, max_y + 1, step):
+                gx, gy = np.meshgrid(cols, np.arange(row, min(row + step, max_y + 1)))
+                centers = tile_xy_to_lon_lat(np.column_stack([gx.ravel(), gy.ravel()]) + 0.5, zoom)
+                inside = polygon.contains(centers)
+                found.update(zip(gx.ravel()[inside].tolist(), gy.ravel()[inside].tolist()))
+        return sorted(found, key=lambda t: (t[1], t[0]))
+
+    def to_dict(self):
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        return {"bbox": [float(min_lon), float(min_lat), float(max_lon), float(max_lat)],
+                "polygons": len(self.polygons)}
+
+
+def feature_centroids(features):
+    """每個 Polygon feature 外環頂點的平均（經緯度），用來判斷 feature 屬於哪個範圍"""
+    return np.array([np.asarray(f["geometry"]["coordinates"][0], dtype=np.float64)[:-1].mean(axis=0)
+                     for f in features]).reshape(-1, 2)
+
+
+def filter_features(features, area):
+    """只留下代表點落在範圍內的 feature"""
+    if not features:
+        return features
+    keep = area.contains(feature_centroids(features))
+    return [f for f, k in zip(features, keep) if k]
@@ -1,45 +1,66 @@
 from http.server import BaseHTTPRequestHandler
-from urllib import parse, request
-import ssl
+from urllib import parse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tile_fetcher import TileFetcher, TileNotFound, DEFAULT_LAYER, cache_headers, is_not_modified
+
+# Shared across requests handled by the same instance
+fetcher = TileFetcher()
 
 # Vercel Python Runtime
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        # Disable SSL verification
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-
         try:
-            # Parse params: /api/proxy?z=..&x=..&y=..
+            # Parse params: /api/proxy?z=..&x=..&y=..[&layer=591|esri]
             query = parse.urlparse(self.path).query
             params = parse.parse_qs(query)
-            
+
+            if params.get('stats', [''])[0]:
+                body = json.dumps(fetcher.stats()).encode()
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
             z = params.get('z', [''])[0]
             x = params.get('x', [''])[0]
             y = params.get('y', [''])[0]
-            
-            if not (z and x and y):
+            layer = params.get('layer', [DEFAULT_LAYER])[0]
+
+            if not (z.isdigit() and x.isdigit() and y.isdigit()) or layer not in fetcher.layers:
                 self.send_response(400)
                 self.end_headers()
                 self.wfile.write(b"Missing params")
                 return
 
-            target_url = f"https://maptiles.591.com.tw/S_Maps/wmts/DMAPS/default/GoogleMapsCompatible/{z}/{y}/{x}"
-            
-            headers = {
-                "User-Agent": "Mozilla/5.0",
-                "Referer": "https://land.591.com.tw/"
-            }
-            
-            req = request.Request(target_url, headers=headers)
-            with request.urlopen(req, context=ctx, timeout=5) as response:
-                self.send_response(200)
-                self.send_header('Content-type', 'image/png')
-                self.send_header('Cache-Control', 'public, max-age=86400')
+            entry, source = fetcher.get(layer, int(z), int(x), int(y))
+            headers = cache_headers(entry, source)
+
+            # Browser already has this tile: answer with headers only
+            if is_not_modified(entry, self.headers.get('If-None-Match'),
+                               self.headers.get('If-Modified-Since')):
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
                 self.end_headers()
-                self.wfile.write(response.read())
-                
+                return
+
+            self.send_response(200)
+            self.send_header('Content-type', fetcher.layers[layer]['content_type'])
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(entry.data)
+
+        except TileNotFound:
+            self.send_response(404)
+            self.end_headers()
         except Exception as e:
             self.send_response(404)
-            self.end_headers()
\ No newline at end of file
+            self.end_headers()
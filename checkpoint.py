@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+長時間偵測的檢查點
+每完成一個單位（逐張模式是一個圖磚，拼接模式是一個區塊）就把結果附加到 partial.ndjson，
+再在 journal.ndjson 記一筆指向它的位置；兩個檔案都只附加、每筆都 fsync。
+中斷後以 --resume 重跑時，journal 裡有紀錄的單位直接還原，不用重新下載偵測。
+journal 第一行是這次執行的設定，設定不同時不能續跑。
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+from geo import json_default
+
+JOURNAL = "journal.ndjson"
+PARTIAL = "partial.ndjson"
+
+
+class CheckpointMismatch(Exception):
+    """要續跑的檢查點與這次的設定不同"""
+
+
+class RunCheckpoint:
+    def __init__(self, directory, header, resume=False):
+        self.directory = directory
+        self.header = header
+        # unit -> ({(tx, ty): [coords, ...]}, info)
+        self.completed = {}
+        os.makedirs(directory, exist_ok=True)
+        journal_path = os.path.join(directory, JOURNAL)
+        partial_path = os.path.join(directory, PARTIAL)
+
+        if resume and os.path.exists(journal_path):
+            journal_end, partial_end = self._load(journal_path, partial_path)
+            # 截掉中斷時寫到一半的尾巴，之後附加的紀錄才會接在完整的最後一行後面
+            os.truncate(journal_path, journal_end)
+            os.truncate(partial_path, partial_end)
+            self._journal = open(journal_path, "a", encoding="utf-8")
+            self._partial = open(partial_path, "ab")
+        else:
+            self._partial = open(partial_path, "wb")
+            self._journal = open(journal_path, "w", encoding="utf-8")
+            self._append_journal({"header": header})
+
+    def _load(self, journal_path, partial_path):
+        """還原 journal 裡的單位，回傳 (journal 有效長度, partial 有效長度)"""
+        with open(journal_path, "rb") as f:
+            data = f.read()
+        entries = []
+        journal_end = 0
+        while True:
+            end = data.find(b"\n", journal_end)
+            if end < 0:
+                # 沒有換行的最後一行是寫到一半被中斷的
+                break
+            try:
+                entries.append(json.loads(data[journal_end:end]))
+            except ValueError:
+                break
+            journal_end = end + 1
+        if not entries or entries[0].get("header") != self.header:
+            raise CheckpointMismatch(f"{journal_path} 是不同設定的執行，請不要加 --resume 重新開始")
+
+        partial_end = 0
+        with open(partial_path, "rb") as f:
+            for entry in entries[1:]:
+                f.seek(entry["offset"])
+                record = json.loads(f.read(entry["length"]))
+                results = {}
+                for key, coords in record["results"].items():
+                    tx, ty = (int(v) for v in key.split("_"))
+                    results[(tx, ty)] = [np.asarray(c, dtype=np.float64) for c in coords]
+                self.completed[record["unit"]] = (results, record.get("info"))
+                partial_end = max(partial_end, entry["offset"] + entry["length"])
+        return journal_end, partial_end
+
+    def _append_journal(self, entry):
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def record(self, unit, results, info=None):
+        """
+        記錄一個完成的單位
+        results: {(tx, ty): [coords, ...]}；info 是要一起還原的附帶資料（例如 manifest 用的雜湊）
+        先寫結果再寫 journal，journal 有的紀錄一定讀得到完整結果
+        """
+        record = {
+            "unit": unit,
+            "results": {f"{tx}_{ty}": coords for (tx, ty), coords in results.items()},
+            "info": info,
+        }
+        data = (json.dumps(record, separators=(",", ":"), default=json_default) + "\n").encode("utf-8")
+        offset = self._partial.seek(0, os.SEEK_END)
+        self._partial.write(data)
+        self._partial.flush()
+        os.fsync(self._partial.fileno())
+        self._append_journal({"unit": unit, "offset": offset, "length": len(data), "time": time.time()})
+        self.completed[unit] = (results, info)
+
+    def close(self):
+        self._partial.close()
+        self._journal.close()
+
+    def finish(self):
+        """整個執行完成，輸出已寫好，刪掉檢查點"""
+        self.close()
+        for name in (JOURNAL, PARTIAL):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
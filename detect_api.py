@@ -5,46 +5,77 @@
 """
 
 import os
-import math
 import json
 import requests
 from io import BytesIO
 from PIL import Image
 import cv2
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from mbtiles import MBTiles
+from lru import LRUCache
+from rate_limit import TokenBucket
+from job_queue import JobQueue, QueueFull, DONE
+from aoi import Area, filter_features
+from geo import TileGrid, tile_bbox, image_to_lon_lat
+from land_area import add_area_properties
 from concurrent.futures import ThreadPoolExecutor
-import time
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """回應時才把 numpy 陣列轉成 list"""
+    
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return DefaultJSONProvider.default(obj)
 
 app = Flask(__name__)
+app.json = NumpyJSONProvider(app)
 
-# 八仙段範圍
+# 八仙段範圍（沒有指定 bbox / polygon 時的預設範圍）
 MIN_LAT = 24.6538
 MAX_LAT = 24.6660
 MIN_LON = 121.7770
 MAX_LON = 121.7935
 ZOOM = 19
+# 一次請求最多偵測幾個圖磚（八仙段整段約 500 個）；超過時回 400，不列舉也不下載
+MAX_TILES = int(os.environ.get("DETECT_MAX_TILES", 20000))
+
+# 衛星圖磚 MBTiles 封存（可選，設定 TILE_ARCHIVE 後先讀封存，沒有才下載並寫入）
+TILE_ARCHIVE = os.environ.get("TILE_ARCHIVE")
+archive = MBTiles(TILE_ARCHIVE) if TILE_ARCHIVE else None
 
-def lat_lon_to_tile(lat, lon, zoom):
-    lat_rad = math.radians(lat)
-    n = 2.0 ** zoom
-    x = int((lon + 180.0) / 360.0 * n)
-    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-    return x, y
+# 兩層快取：解碼後的圖磚（與參數無關）、每個 (圖磚, 參數) 的偵測結果
+TILE_CACHE_BYTES = int(os.environ.get("DETECT_TILE_CACHE_BYTES", 256 * 1024 * 1024))
+RESULT_CACHE_ITEMS = int(os.environ.get("DETECT_RESULT_CACHE_ITEMS", 20000))
+tile_cache = LRUCache(max_bytes=TILE_CACHE_BYTES, sizeof=lambda img: img.nbytes)
+result_cache = LRUCache(max_items=RESULT_CACHE_ITEMS)
 
-def tile_to_lat_lon(x, y, zoom):
-    n = 2.0 ** zoom
-    lon = x / n * 360.0 - 180.0
-    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * y / n)))
-    lat = math.degrees(lat_rad)
-    return lat, lon
+# 只有真的要下載時才限速（原本每個圖磚固定 sleep 0.02 秒）
+download_limiter = TokenBucket(50)
+
+# 背景偵測工作：worker 數與排隊上限
+JOB_WORKERS = int(os.environ.get("DETECT_JOB_WORKERS", 2))
+JOB_MAX_QUEUED = int(os.environ.get("DETECT_JOB_MAX_QUEUED", 16))
+jobs = JobQueue(JOB_WORKERS, JOB_MAX_QUEUED)
 
 def download_tile(x, y, zoom):
     url = f"https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{zoom}/{y}/{x}"
     try:
-        resp = requests.get(url, timeout=10, headers={'User-Agent': 'OpenClaw/1.0'})
-        if resp.status_code == 200:
-            img = Image.open(BytesIO(resp.content))
+        data = archive.read_tile(zoom, x, y) if archive else None
+        if data is None:
+            download_limiter.acquire()
+            resp = requests.get(url, timeout=10, headers={'User-Agent': 'OpenClaw/1.0'})
+            if resp.status_code == 200:
+                data = resp.content
+                if archive:
+                    archive.put(zoom, x, y, data)
+        if data is not None:
+            img = Image.open(BytesIO(data))
             return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
     except:
         pass
@@ -82,23 +113,16 @@ def detect_boundaries(image, canny_low, canny_high, min_area):
     return valid
 
 def to_geojson(contours, img_shape, min_lon, min_lat, max_lon, max_lat):
-    h, w = img_shape[:2]
-    lon_per = (max_lon - min_lon) / w
-    lat_per = (max_lat - min_lat) / h
-    
     features = []
     for i, c in enumerate(contours):
-        coords = []
-        for pt in c:
-            px, py = pt[0]
-            lon = min_lon + px * lon_per
-            lat = max_lat - py * lat_per
-            coords.append([lon, lat])
+        # 整個輪廓一次換算，座標保持 numpy 陣列，回應時才轉成 list
+        coords = image_to_lon_lat(c, img_shape, min_lon, min_lat, max_lon, max_lat)
         
-        if coords and coords[0] != coords[-1]:
-            coords.append(coords[0])
+        if len(coords) and not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack([coords, coords[:1]])
         
         if len(coords) >= 3:
+            pixels = cv2.contourArea(c)
             features.append({
                 "type": "Feature",
                 "geometry": {
@@ -107,54 +131,230 @@ def to_geojson(contours, img_shape, min_lon, min_lat, max_lon, max_lat):
                 },
                 "properties": {
                     "id": i,
-                    "area": cv2.contourArea(c)
+                    # area 是原本的欄位（像素面積），保留給既有的呼叫端
+                    "area": pixels,
+                    "area_pixels": pixels
                 }
             })
     
+    # 像素面積隨 zoom 與緯度而變，另外一次算出所有多邊形的實際面積（平方公尺、坪、分）
+    add_area_properties(features)
     return {"type": "FeatureCollection", "features": features}
 
+def get_tile(x, y, zoom):
+    """解碼後的圖磚，先查記憶體快取；下載失敗不快取，下次再試"""
+    key = (zoom, x, y)
+    tile = tile_cache.get(key)
+    if tile is None:
+        tile = download_tile(x, y, zoom)
+        if tile is not None:
+            tile_cache.put(key, tile)
+    return tile
+
+def detect_tile(x, y, zoom, canny_low, canny_high, min_area):
+    """單一圖磚的 feature 列表，依 (圖磚, 參數) 快取；回傳的 feature 不可修改"""
+    key = (zoom, x, y, canny_low, canny_high, min_area)
+    features = result_cache.get(key)
+    if features is not None:
+        return features
+    
+    tile = get_tile(x, y, zoom)
+    if tile is None:
+        return []
+    
+    features = []
+    contours = detect_boundaries(tile, canny_low, canny_high, min_area)
+    if contours:
+        min_lon, min_lat, max_lon, max_lat = tile_bbox(x, y, zoom)
+        features = to_geojson(contours, tile.shape, min_lon, min_lat, max_lon, max_lat)['features']
+        for f in features:
+            f['properties']['tile'] = f"{x}_{y}"
+    result_cache.put(key, features)
+    return features
+
+def get_params():
+    """偵測參數（query string）"""
+    return {
+        "canny_low": request.args.get('canny_low', 30, type=int),
+        "canny_high": request.args.get('canny_high', 80, type=int),
+        "min_area": request.args.get('min_area', 40, type=int)
+    }
+
+class InvalidArea(Exception):
+    """bbox / polygon 參數不合法"""
+
+@app.errorhandler(InvalidArea)
+def invalid_area(e):
+    return jsonify({"error": f"invalid area: {e}"}), 400
+
+def get_area():
+    """
+    偵測範圍：?bbox=min_lon,min_lat,max_lon,max_lat、?polygon=<GeoJSON>，
+    或 POST 的 JSON body（GeoJSON Polygon/MultiPolygon/Feature/FeatureCollection）；
+    都沒有就是整個八仙段（回傳 None）
+    """
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    try:
+        return Area.from_request_args(request.args, body)
+    except ValueError as e:
+        raise InvalidArea(str(e))
+
+def area_tiles(area):
+    """範圍內的圖磚 (x, y)；area 為 None 時是八仙段的整個矩形"""
+    if area is not None:
+        try:
+            return area.tiles(ZOOM, MAX_TILES)
+        except ValueError as e:
+            raise InvalidArea(str(e))
+    return TileGrid.from_bbox(MIN_LON, MIN_LAT, MAX_LON, MAX_LAT, ZOOM).tiles()
+
+def iter_section(tiles, params, job=None, area=None):
+    """
+    逐一偵測圖磚，每完成一個圖磚 yield 它的 feature 列表；在背景工作中執行時回報進度並可被取消
+    有指定範圍時只留下代表點在範圍內的 feature（圖磚本身可能超出範圍）
+    """
+    if job:
+        job.set_total(len(tiles))
+    
+    for x, y in tiles:
+        if job:
+            job.check()
+        features = detect_tile(x, y, ZOOM, params['canny_low'], params['canny_high'], params['min_area'])
+        yield filter_features(features, area) if area is not None else features
+        if job:
+            job.advance()
+    
+    if archive:
+        archive.flush()
+
+def detect_section(tiles, params, job=None, area=None):
+    all_features = []
+    for features in iter_section(tiles, params, job, area):
+        all_features.extend(features)
+    
+    return {
+        "count": len(all_features),
+        "params": params,
+        "area": area.to_dict() if area is not None else None,
+        "tiles": len(tiles),
+        "data": {"type": "FeatureCollection", "features": all_features}
+    }
+
+def dump_feature(feature):
+    return json.dumps(feature, ensure_ascii=False, separators=(',', ':'), default=NumpyJSONProvider.default)
+
 @app.route('/detect', methods=['GET', 'POST'])
 def detect():
-    # 取得參數
-    canny_low = request.args.get('canny_low', 30, type=int)
-    canny_high = request.args.get('canny_high', 80, type=int)
-    min_area = request.args.get('min_area', 40, type=int)
+    params = get_params()
+    print(f"偵測參數: canny_low={params['canny_low']}, canny_high={params['canny_high']}, min_area={params['min_area']}")
+    area = get_area()
+    return jsonify(detect_section(area_tiles(area), params, area=area))
+
+@app.route('/detect/stream', methods=['GET', 'POST'])
+def detect_stream():
+    """
+    邊偵測邊輸出，每完成一個圖磚就送出它的 feature
+    format=ndjson（預設）: 每行一個 Feature
+    format=geojson: 分段輸出的單一 FeatureCollection
+    """
+    params = get_params()
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'geojson'):
+        return jsonify({"error": "format must be ndjson or geojson"}), 400
+    area = get_area()
+    tiles = area_tiles(area)
     
-    print(f"偵測參數: canny_low={canny_low}, canny_high={canny_high}, min_area={min_area}")
+    def ndjson():
+        for features in iter_section(tiles, params, area=area):
+            if features:
+                yield ''.join(dump_feature(f) + '\n' for f in features)
     
-    # 計算圖磚範圍
-    min_tx, min_ty = lat_lon_to_tile(MAX_LAT, MIN_LON, ZOOM)
-    max_tx, max_ty = lat_lon_to_tile(MIN_LAT, MAX_LON, ZOOM)
+    def geojson():
+        yield '{"type":"FeatureCollection","features":['
+        first = True
+        for features in iter_section(tiles, params, area=area):
+            if features:
+                chunk = ','.join(dump_feature(f) for f in features)
+                yield chunk if first else ',' + chunk
+                first = False
+        yield ']}\n'
     
-    all_features = []
+    if fmt == 'ndjson':
+        return Response(ndjson(), mimetype='application/x-ndjson')
+    return Response(geojson(), mimetype='application/geo+json')
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """送出偵測工作，立即回傳 job id"""
+    params = get_params()
+    area = get_area()
+    tiles = area_tiles(area)
+    try:
+        job = jobs.submit(lambda job: detect_section(tiles, params, job, area), params)
+    except QueueFull:
+        resp = jsonify({"error": "job queue is full"})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '5'
+        return resp
     
-    for y in range(min_ty, max_ty + 1):
-        for x in range(min_tx, max_tx + 1):
-            lat1, lon1 = tile_to_lat_lon(x, y, ZOOM)
-            lat2, lon2 = tile_to_lat_lon(x + 1, y + 1, ZOOM)
-            
-            tile = download_tile(x, y, ZOOM)
-            if tile:
-                contours = detect_boundaries(tile, canny_low, canny_high, min_area)
-                
-                if contours:
-                    coords = to_geojson(contours, tile.shape, lon1, lat2, lon2, lat1)
-                    for c in coords['features']:
-                        c['properties']['tile'] = f"{x}_{y}"
-                        all_features.append(c)
-            
-            time.sleep(0.02)  # 避免請求太快
-    
-    result = {"type": "FeatureCollection", "features": all_features}
+    resp = jsonify(job.to_dict())
+    resp.status_code = 202
+    resp.headers['Location'] = f"/jobs/{job.id}"
+    return resp
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 Server-Sent Events 推送狀態與進度，直到工作結束"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
     
+    def stream():
+        version = -1
+        while True:
+            current = job.wait(version, timeout=15)
+            if current == version and not job.finished:
+                # 心跳，避免閒置連線被代理切斷
+                yield ": keep-alive\n\n"
+                continue
+            version = current
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store'})
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    if job.status != DONE:
+        # 還沒完成（或已失敗/取消），回傳目前狀態
+        return jsonify(job.to_dict()), 409
+    return jsonify(job.result)
+
+@app.route('/cache/stats')
+def cache_stats():
     return jsonify({
-        "count": len(all_features),
-        "params": {
-            "canny_low": canny_low,
-            "canny_high": canny_high,
-            "min_area": min_area
-        },
-        "data": result
+        "tiles": tile_cache.stats(),
+        "results": result_cache.stats(),
+        "jobs": jobs.stats()
     })
 
 @app.route('/')
@@ -164,6 +364,11 @@ def index():
     <p>使用方法：</p>
     <ul>
         <li>/detect?canny_low=30&canny_high=80&min_area=40</li>
+        <li>範圍：&bbox=min_lon,min_lat,max_lon,max_lat、&polygon=&lt;GeoJSON&gt;，或 POST GeoJSON（預設整個八仙段）</li>
+        <li>/detect/stream?format=ndjson|geojson（每個圖磚完成就輸出）</li>
+        <li>POST /jobs?canny_low=30&canny_high=80&min_area=40 → job id</li>
+        <li>/jobs/&lt;id&gt;（狀態與進度）、/jobs/&lt;id&gt;/events（SSE）、/jobs/&lt;id&gt;/result、DELETE /jobs/&lt;id&gt;（取消）</li>
+        <li>/cache/stats</li>
     </ul>
     '''
 
@@ -5,7 +5,6 @@
 """
 
 import os
-import math
 import json
 import requests
 from io import BytesIO
@@ -13,6 +12,10 @@ from PIL import Image
 import cv2
 import numpy as np
 from pathlib import Path
+from mbtiles import MBTiles
+import polygon_simplify
+from geo import TileGrid, lat_lon_to_tile, meters_to_tile_offset, image_to_lon_lat, json_default
+from land_area import add_area_properties
 
 # 八仙段中心座標
 CENTER_LAT = 24.6185
@@ -24,33 +27,13 @@ RADIUS_METERS = 500
 
 OUTPUT_FILE = "drone-app/baxian_boundaries.json"
 
-def lat_lon_to_tile(lat, lon, zoom):
-    """轉換經緯度到圖磚座標"""
-    lat_rad = math.radians(lat)
-    n = 2.0 ** zoom
-    x = int((lon + 180.0) / 360.0 * n)
-    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-    return x, y
+# 輸出前的多邊形簡化容許誤差（公尺，0 = 不簡化）與座標小數位數
+SIMPLIFY_METERS = polygon_simplify.DEFAULT_TOLERANCE_M
+COORD_PRECISION = polygon_simplify.DEFAULT_PRECISION
 
-def tile_to_lat_lon(x, y, zoom):
-    """轉換圖磚座標到經緯度"""
-    n = 2.0 ** zoom
-    lon = x / n * 360.0 - 180.0
-    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * y / n)))
-    lat = math.degrees(lat_rad)
-    return lat, lon
-
-def get_tile_bbox(x, y, zoom):
-    """取得圖磚的邊界座標"""
-    lat1, lon1 = tile_to_lat_lon(x, y)
-    lat2, lon2 = tile_to_lat_lon(x + 1, y + 1)
-    return lon1, lat2, lon2, lat1  # min_lon, max_lat, max_lon, min_lat
-
-def meters_to_tile_offset(meters, lat, zoom):
-    """將米轉換為圖磚偏移量"""
-    # 1 degree latitude ≈ 111,320 meters
-    tiles_per_meter = (2**zoom) / (111320 * math.cos(math.radians(lat)) * 360)
-    return meters * tiles_per_meter
+# 衛星圖磚 MBTiles 封存（可選，設定 TILE_ARCHIVE 後先讀封存，沒有才下載並寫入）
+TILE_ARCHIVE = os.environ.get("TILE_ARCHIVE")
+archive = MBTiles(TILE_ARCHIVE) if TILE_ARCHIVE else None
 
 def download_tile(x, y, zoom):
     """下載單個圖磚"""
@@ -58,9 +41,15 @@ def download_tile(x, y, zoom):
     url = f"https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{zoom}/{y}/{x}"
     
     try:
-        resp = requests.get(url, timeout=10)
-        if resp.status_code == 200:
-            img = Image.open(BytesIO(resp.content))
+        data = archive.read_tile(zoom, x, y) if archive else None
+        if data is None:
+            resp = requests.get(url, timeout=10)
+            if resp.status_code == 200:
+                data = resp.content
+                if archive:
+                    archive.put(zoom, x, y, data)
+        if data is not None:
+            img = Image.open(BytesIO(data))
             return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
     except Exception as e:
         print(f"下載圖磚 ({x},{y}) 失敗: {e}")
@@ -107,25 +96,16 @@ def detect_boundaries(image):
     return valid_contours, image.shape[:2]
 
 def contours_to_geojson(contours, img_shape, min_lon, min_lat, max_lon, max_lat):
-    """將輪廓轉換為 GeoJSON"""
+    """將輪廓轉換為 GeoJSON（座標為 numpy 陣列，寫檔時才轉成 list）"""
     features = []
     
-    h, w = img_shape
-    lon_per_pixel = (max_lon - min_lon) / w
-    lat_per_pixel = (max_lat - min_lat) / h
-    
     for i, contour in enumerate(contours):
-        coords = []
-        for point in contour:
-            px, py = point[0]
-            # 轉換像素座標到經緯度
-            lon = min_lon + px * lon_per_pixel
-            lat = max_lat - py * lat_per_pixel  # Y 軸反向
-            coords.append([lon, lat])
+        # 轉換像素座標到經緯度（整個輪廓一次換算）
+        coords = image_to_lon_lat(contour, img_shape, min_lon, min_lat, max_lon, max_lat)
         
         # 閉合多邊形
-        if coords[0] != coords[-1]:
-            coords.append(coords[0])
+        if not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack([coords, coords[:1]])
         
         feature = {
             "type": "Feature",
@@ -169,6 +149,9 @@ def main():
             if tile is not None:
                 tiles.append((dx + 1, dy + 1, tile))
     
+    if archive:
+        archive.close()
+    
     if not tiles:
         print("無法下載任何圖磚！")
         return
@@ -190,23 +173,28 @@ def main():
     print("偵測邊界...")
     contours, shape = detect_boundaries(merged)
     
-    # 計算地理範圍
-    # 左上角圖磚
-    min_lat, min_lon = tile_to_lat_lon(center_x - 1, center_y - 1, ZOOM)
-    # 右下角圖磚  
-    max_lat, max_lon = tile_to_lat_lon(center_x + 2, center_y + 2, ZOOM)
+    # 計算地理範圍（3x3 圖磚的外框）
+    min_lon, min_lat, max_lon, max_lat = TileGrid(center_x - 1, center_y - 1, center_x + 1, center_y + 1, ZOOM).extent()
     
     print(f"地理範圍: lon {min_lon:.6f} ~ {max_lon:.6f}, lat {min_lat:.6f} ~ {max_lat:.6f}")
     
     # 轉 GeoJSON
     geojson = contours_to_geojson(contours, shape, min_lon, min_lat, max_lon, max_lat)
     
+    # 面積（簡化前以完整精度計算）
+    add_area_properties(geojson['features'])
+    
+    # 簡化 + 量化
+    bytes_before = len(json.dumps(geojson, indent=2, ensure_ascii=False, default=json_default).encode('utf-8'))
+    stats = polygon_simplify.simplify_features(geojson['features'], SIMPLIFY_METERS, "dp", COORD_PRECISION)
+    
     # 儲存
     output_path = Path(OUTPUT_FILE)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(geojson, f, indent=2, ensure_ascii=False)
+        json.dump(geojson, f, separators=(',', ':'), ensure_ascii=False, default=json_default)
+    polygon_simplify.print_report(stats, bytes_before, output_path.stat().st_size)
     
     print(f"完成！")
     print(f"總共偵測到: {len(geojson['features'])} 塊")
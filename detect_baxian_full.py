@@ -5,7 +5,6 @@
 """
 
 import os
-import math
 import json
 import requests
 from io import BytesIO
@@ -13,8 +12,20 @@ from PIL import Image
 import cv2
 import numpy as np
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from mbtiles import MBTiles
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
 import time
+import threading
+from rate_limit import TokenBucket
+import shm_pool
+from seam_merge import merge_seams
+import polygon_simplify
+from aoi import Area, filter_features
+from land_area import add_area_properties
+from geo import TileGrid, tile_to_lat_lon, image_to_lon_lat, json_default
+from detect_manifest import DetectionManifest, tile_digest, params_digest
+from checkpoint import RunCheckpoint, CheckpointMismatch
 
 # 八仙段範圍（從 1126 個中心點計算）
 MIN_LAT = 24.6538
@@ -30,36 +41,109 @@ MIN_AREA = 300  # 最小面積
 CANNY_LOW = 30
 CANNY_HIGH = 80
 
-def lat_lon_to_tile(lat, lon, zoom):
-    """經緯度轉圖磚座標"""
-    lat_rad = math.radians(lat)
-    n = 2.0 ** zoom
-    x = int((lon + 180.0) / 360.0 * n)
-    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-    return x, y
-
-def tile_to_lat_lon(x, y, zoom):
-    """圖磚座標轉經緯度"""
-    n = 2.0 ** zoom
-    lon = x / n * 360.0 - 180.0
-    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * y / n)))
-    lat = math.degrees(lat_rad)
-    return lat, lon
+# 改了偵測演算法就加 1，讓 manifest 裡的舊結果失效
+DETECTOR_VERSION = 1
+DETECT_PARAMS = {
+    "zoom": ZOOM,
+    "min_area": MIN_AREA,
+    "canny_low": CANNY_LOW,
+    "canny_high": CANNY_HIGH,
+    "version": DETECTOR_VERSION,
+}
+MANIFEST_FILE = "drone-app/baxian_all_boundaries.manifest.json"
+# 執行中的檢查點（完成後刪除）
+CHECKPOINT_DIR = "drone-app/baxian_all_boundaries.run"
 
-def download_tile(x, y, zoom):
-    """下載單個圖磚"""
+# 衛星圖磚 MBTiles 封存（可選，設定 TILE_ARCHIVE 後先讀封存，沒有才下載並寫入）
+TILE_ARCHIVE = os.environ.get("TILE_ARCHIVE")
+archive = MBTiles(TILE_ARCHIVE) if TILE_ARCHIVE else None
+
+# 上游回 304：圖磚與上次相同
+NOT_MODIFIED = object()
+
+def is_image(data):
+    """圖磚內容是否為影像（只讀檔頭與結構，不解碼像素）"""
+    try:
+        Image.open(BytesIO(data)).verify()
+        return True
+    except Exception:
+        return False
+
+def download_tile_checked(x, y, zoom, etag=None, last_modified=None):
+    """
+    下載單個圖磚（未解碼的原始內容），回傳 (data, etag, last_modified)
+    帶上次的驗證值且上游回 304 時 data 為 NOT_MODIFIED，失敗時為 None
+    """
     # 使用 ESRI 衛星圖
     url = f"https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{zoom}/{y}/{x}"
     
     try:
-        resp = requests.get(url, timeout=10, headers={'User-Agent': 'OpenClaw/1.0'})
+        data = archive.read_tile(zoom, x, y) if archive else None
+        if data is not None and is_image(data):
+            return data, None, None
+        
+        headers = {'User-Agent': 'OpenClaw/1.0'}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        resp = requests.get(url, timeout=10, headers=headers)
+        if resp.status_code == 304 and (etag or last_modified):
+            return NOT_MODIFIED, etag, last_modified
         if resp.status_code == 200:
-            img = Image.open(BytesIO(resp.content))
-            return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+            data = resp.content
+            # 限流或錯誤時上游可能回 200 的 HTML，當成下載失敗，也不要存進圖磚庫
+            if not is_image(data):
+                raise ValueError(f"not an image ({resp.headers.get('Content-Type')})")
+            if archive:
+                archive.put(zoom, x, y, data)
+            return data, resp.headers.get('ETag'), resp.headers.get('Last-Modified')
     except Exception as e:
         print(f"下載失敗 ({x},{y}): {e}")
     
-    return None
+    return None, None, None
+
+def download_tile_bytes(x, y, zoom):
+    """下載單個圖磚（未解碼的原始內容）"""
+    return download_tile_checked(x, y, zoom)[0]
+
+def fetch_incremental(tx, ty, zoom, manifest):
+    """
+    增量模式的下載：回傳 (data, cached, info)
+    影像與參數都沒變時 cached 是 manifest 裡的偵測結果（不用再偵測），data 為 None；
+    否則 info = (sha256, etag, last_modified)，偵測完用來更新 manifest
+    """
+    if manifest is None:
+        return download_tile_bytes(tx, ty, zoom), None, None
+    
+    etag, last_modified = manifest.validators(tx, ty)
+    data, etag, last_modified = download_tile_checked(tx, ty, zoom, etag, last_modified)
+    if data is NOT_MODIFIED:
+        return None, manifest.lookup(tx, ty), None
+    if data is None:
+        # 下載失敗時沿用上次的結果，不要讓輸出少一塊
+        return None, manifest.lookup(tx, ty), None
+    
+    digest = tile_digest(data)
+    cached = manifest.lookup(tx, ty, digest)
+    if cached is not None:
+        return None, cached, None
+    return data, None, (digest, etag, last_modified)
+
+def decode_tile(data):
+    """圖磚內容轉 BGR 影像；沒有內容或無法解碼時回傳 None（當成缺圖磚）"""
+    if data is None:
+        return None
+    try:
+        img = Image.open(BytesIO(data)).convert('RGB')
+    except Exception as e:
+        print(f"圖磚無法解碼: {e}")
+        return None
+    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+
+def download_tile(x, y, zoom):
+    """下載單個圖磚"""
+    return decode_tile(download_tile_bytes(x, y, zoom))
 
 def detect_boundaries_in_image(image):
     """偵測圖片中的土地邊界"""
@@ -95,34 +179,41 @@ def detect_boundaries_in_image(image):
     return valid
 
 def image_to_geojson_contours(contours, img_shape, min_lon, min_lat, max_lon, max_lat):
-    """將輪廓轉為 GeoJSON 座標"""
-    h, w = img_shape[:2]
-    lon_per_px = (max_lon - min_lon) / w
-    lat_per_px = (max_lat - min_lat) / h
+    """將輪廓轉為 GeoJSON 座標（回傳 (N, 2) numpy 陣列，寫檔時才轉成 list）"""
+    if not len(contours):
+        return []
+    
+    # 所有輪廓接成一個陣列一次換算
+    lengths = [len(c) for c in contours]
+    lonlat = image_to_lon_lat(np.concatenate(contours), img_shape, min_lon, min_lat, max_lon, max_lat)
     
     coords_list = []
-    for contour in contours:
-        coords = []
-        for point in contour:
-            px, py = point[0]
-            lon = min_lon + px * lon_per_px
-            lat = max_lat - py * lat_per_px
-            coords.append([lon, lat])
-        
+    for coords in np.split(lonlat, np.cumsum(lengths)[:-1]):
         # 閉合
-        if coords and coords[0] != coords[-1]:
-            coords.append(coords[0])
+        if len(coords) and not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack([coords, coords[:1]])
         
         if len(coords) >= 3:
             coords_list.append(coords)
     
     return coords_list
 
-def process_tile(tx, ty, zoom, tile_bounds):
-    """處理單個圖磚"""
-    print(f"處理圖磚: ({tx}, {ty})")
-    tile = download_tile(tx, ty, zoom)
-    
+def detect_tile(data, tile_bounds):
+    """
+    解碼 + 偵測單個圖磚（在 worker process 執行，只傳壓縮過的圖磚內容）
+    無法解碼時回傳 None，與下載失敗一樣不記錄，下次再試
+    """
+    tile = decode_tile(data)
+    if tile is None:
+        return None
+    return detect_image(tile, tile_bounds)
+
+def detect_tile_shm(slot, h, w, tile_bounds):
+    """偵測共享記憶體 slot 裡的圖磚（在 worker process 執行）"""
+    return detect_image(shm_pool.worker_array(slot)[:h, :w], tile_bounds)
+
+def detect_image(tile, tile_bounds):
+    """偵測單張影像並轉成經緯度座標"""
     if tile is None:
         return []
     
@@ -136,66 +227,463 @@ def process_tile(tx, ty, zoom, tile_bounds):
     
     return []
 
+def process_tile(tx, ty, zoom, tile_bounds):
+    """處理單個圖磚"""
+    print(f"處理圖磚: ({tx}, {ty})")
+    return detect_tile(download_tile_bytes(tx, ty, zoom), tile_bounds) or []
+
+def detect_mosaic(tile_data, window, core, zoom, tile_size=256):
+    """
+    拼接多個圖磚後一次偵測（在 worker process 執行）
+    tile_data: {(tx, ty): 圖磚內容}
+    window / core: (x0, y0, x1, y1) 全域像素座標；window 含重疊區，core 是這一塊負責的範圍
+    重疊區的多邊形只由重心所在的那一塊輸出，相鄰兩塊不會重複
+    回傳 ({(tx, ty): coords}, 無法解碼的圖磚)，tx, ty 為多邊形重心所在的圖磚
+    """
+    x0, y0, x1, y1 = window
+    mosaic = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+    failed = []
+    
+    for (tx, ty), data in tile_data.items():
+        tile = decode_tile(data)
+        if tile is None:
+            failed.append((tx, ty))
+            continue
+        # 圖磚與視窗的交集
+        left, top = tx * tile_size, ty * tile_size
+        ix0, iy0 = max(left, x0), max(top, y0)
+        ix1, iy1 = min(left + tile.shape[1], x1), min(top + tile.shape[0], y1)
+        if ix0 >= ix1 or iy0 >= iy1:
+            continue
+        mosaic[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = tile[iy0 - top:iy1 - top, ix0 - left:ix1 - left]
+    
+    contours = detect_boundaries_in_image(mosaic)
+    
+    max_lat, min_lon = tile_to_lat_lon(x0 / tile_size, y0 / tile_size, zoom)
+    min_lat, max_lon = tile_to_lat_lon(x1 / tile_size, y1 / tile_size, zoom)
+    
+    cx0, cy0, cx1, cy1 = core
+    results = {}
+    for c in contours:
+        m = cv2.moments(c)
+        if m['m00']:
+            gx, gy = x0 + m['m10'] / m['m00'], y0 + m['m01'] / m['m00']
+        else:
+            bx, by, bw, bh = cv2.boundingRect(c)
+            gx, gy = x0 + bx + bw / 2, y0 + by + bh / 2
+        if not (cx0 <= gx < cx1 and cy0 <= gy < cy1):
+            continue
+        coords = image_to_geojson_contours([c], mosaic.shape, min_lon, min_lat, max_lon, max_lat)
+        if coords:
+            key = (int(gx // tile_size), int(gy // tile_size))
+            results.setdefault(key, []).extend(coords)
+    
+    return results, failed
+
+def build_chunks(tiles, chunk, overlap, tile_size=256):
+    """把圖磚範圍切成 chunk x chunk 的區塊，回傳 [(window, core, [(tx, ty), ...]), ...]"""
+    xs = [t[0] for t in tiles]
+    ys = [t[1] for t in tiles]
+    min_tx, max_tx, min_ty, max_ty = min(xs), max(xs), min(ys), max(ys)
+    
+    # 重疊區不超出整個範圍，避免多抓範圍外的圖磚
+    lo_x, lo_y = min_tx * tile_size, min_ty * tile_size
+    hi_x, hi_y = (max_tx + 1) * tile_size, (max_ty + 1) * tile_size
+    # 不規則範圍（多邊形）只抓範圍內的圖磚，範圍外當作空白
+    wanted = {(t[0], t[1]) for t in tiles}
+    
+    chunks = []
+    for cy in range(min_ty, max_ty + 1, chunk):
+        for cx in range(min_tx, max_tx + 1, chunk):
+            ex, ey = min(cx + chunk, max_tx + 1), min(cy + chunk, max_ty + 1)
+            core = (cx * tile_size, cy * tile_size, ex * tile_size, ey * tile_size)
+            window = (max(core[0] - overlap, lo_x), max(core[1] - overlap, lo_y),
+                      min(core[2] + overlap, hi_x), min(core[3] + overlap, hi_y))
+            if not any((tx, ty) in wanted for ty in range(cy, ey) for tx in range(cx, ex)):
+                continue
+            needed = [(tx, ty)
+                      for ty in range(window[1] // tile_size, (window[3] - 1) // tile_size + 1)
+                      for tx in range(window[0] // tile_size, (window[2] - 1) // tile_size + 1)
+                      if (tx, ty) in wanted]
+            chunks.append((window, core, needed))
+    return chunks
+
+def run_mosaic_pipeline(tiles, download_workers, detect_workers, rate, chunk, overlap, checkpoint=None):
+    """
+    拼接模式：圖磚下載完就放進所屬的區塊，區塊的圖磚到齊就送去 process pool 偵測
+    有檢查點時已完成的區塊直接還原，每完成一個區塊就記錄
+    回傳格式與 run_pipeline 相同
+    """
+    bucket = TokenBucket(rate)
+    zoom = tiles[0][2]
+    chunks = build_chunks(tiles, chunk, overlap)
+    
+    results = {}
+    done = 0
+    todo = []
+    for i in range(len(chunks)):
+        restored = checkpoint.completed.get(f"chunk_{i}") if checkpoint else None
+        if restored is None:
+            todo.append(i)
+            continue
+        for key, coords in restored[0].items():
+            results.setdefault(key, []).extend(coords)
+        done += 1
+    if done:
+        print(f"續跑: {done} 個區塊已完成")
+    
+    # 每個圖磚屬於哪些區塊，全部送出後就可以丟掉內容
+    waiting = [len(needed) for _, _, needed in chunks]
+    tile_chunks = {}
+    for i in todo:
+        for key in chunks[i][2]:
+            tile_chunks.setdefault(key, []).append(i)
+    tile_refs = {key: len(v) for key, v in tile_chunks.items()}
+    tile_bytes = {}
+    # 有圖磚沒抓到的區塊：結果照樣輸出，但不記入檢查點，續跑時重抓
+    incomplete = set()
+    
+    downloaded_bytes = 0
+    start = time.time()
+    print(f"拼接模式: {len(chunks)} 個區塊（{chunk}x{chunk} 圖磚，重疊 {overlap}px）")
+    
+    def fetch(key):
+        bucket.acquire()
+        return key, download_tile_bytes(key[0], key[1], zoom)
+    
+    with ThreadPoolExecutor(max_workers=download_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=detect_workers) as cpu_pool:
+        pending = {io_pool.submit(fetch, key) for key in tile_chunks}
+        detections = {}
+        
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                if fut in detections:
+                    i = detections.pop(fut)
+                    chunk_results, failed = fut.result()
+                    if failed:
+                        incomplete.add(i)
+                    if checkpoint and i not in incomplete:
+                        checkpoint.record(f"chunk_{i}", chunk_results)
+                    for key, coords in chunk_results.items():
+                        results.setdefault(key, []).extend(coords)
+                    done += 1
+                    if done % 10 == 0 or done == len(chunks):
+                        elapsed = time.time() - start
+                        print(f"[{done}/{len(chunks)}] {done / elapsed:.1f} 區塊/秒, "
+                              f"已下載 {downloaded_bytes / 1024 / 1024:.1f} MB")
+                    continue
+                
+                key, data = fut.result()
+                if data is not None:
+                    tile_bytes[key] = data
+                    downloaded_bytes += len(data)
+                else:
+                    incomplete.update(tile_chunks[key])
+                
+                for i in tile_chunks[key]:
+                    waiting[i] -= 1
+                    if waiting[i]:
+                        continue
+                    window, core, needed = chunks[i]
+                    data_map = {k: tile_bytes[k] for k in needed if k in tile_bytes}
+                    det = cpu_pool.submit(detect_mosaic, data_map, window, core, zoom)
+                    detections[det] = i
+                    pending.add(det)
+                    for k in needed:
+                        tile_refs[k] -= 1
+                        if not tile_refs[k]:
+                            tile_bytes.pop(k, None)
+    
+    elapsed = time.time() - start
+    print(f"下載+偵測耗時 {elapsed:.1f} 秒（{len(tiles) / max(elapsed, 1e-9):.1f} 圖磚/秒）")
+    if incomplete:
+        print(f"{len(incomplete)} 個區塊有圖磚沒抓到")
+    return results
+
+def record_tile(tx, ty, coords, info, manifest, checkpoint):
+    """一個圖磚完成：新偵測的結果寫回 manifest，並記到檢查點"""
+    if manifest is not None and info is not None:
+        manifest.update(tx, ty, info[0], coords, info[1], info[2])
+    if checkpoint:
+        checkpoint.record(f"{tx}_{ty}", {(tx, ty): coords}, info)
+
+def run_pipeline(tiles, download_workers, detect_workers, rate, manifest=None, checkpoint=None):
+    """
+    下載與偵測並行：
+    執行緒池下載（token bucket 限速）-> process pool 跑 OpenCV
+    有 manifest 時沒變的圖磚沿用上次結果，偵測完的圖磚寫回 manifest
+    有檢查點時每個完成的圖磚都會記錄
+    回傳 {(tx, ty): coords}
+    """
+    bucket = TokenBucket(rate)
+    results = {}
+    total = len(tiles)
+    done = 0
+    reused = 0
+    downloaded_bytes = 0
+    start = time.time()
+    
+    def fetch(tile):
+        bucket.acquire()
+        tx, ty, zoom, bounds = tile
+        return (tile,) + fetch_incremental(tx, ty, zoom, manifest)
+    
+    with ThreadPoolExecutor(max_workers=download_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=detect_workers) as cpu_pool:
+        pending = {io_pool.submit(fetch, t) for t in tiles}
+        detections = {}
+        
+        # 下載完成就送去偵測，偵測完成就記錄，兩種工作在同一個迴圈等
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                if fut in detections:
+                    tx, ty, info = detections.pop(fut)
+                    coords = fut.result()
+                    done += 1
+                    if coords is not None:
+                        results[(tx, ty)] = coords
+                        record_tile(tx, ty, coords, info, manifest, checkpoint)
+                    if done % 50 == 0 or done == total:
+                        elapsed = time.time() - start
+                        print(f"[{done}/{total}] {done / elapsed:.1f} 圖磚/秒, "
+                              f"已下載 {downloaded_bytes / 1024 / 1024:.1f} MB")
+                    continue
+                
+                (tx, ty, zoom, bounds), data, cached, info = fut.result()
+                if cached is not None:
+                    results[(tx, ty)] = cached
+                    reused += 1
+                    record_tile(tx, ty, cached, None, None, checkpoint)
+                if data is None:
+                    done += 1
+                    continue
+                downloaded_bytes += len(data)
+                det = cpu_pool.submit(detect_tile, data, bounds)
+                detections[det] = (tx, ty, info)
+                pending.add(det)
+    
+    elapsed = time.time() - start
+    print(f"下載+偵測耗時 {elapsed:.1f} 秒（{total / max(elapsed, 1e-9):.1f} 圖磚/秒）")
+    if manifest is not None:
+        print(f"增量: {reused} 個圖磚沿用上次結果，{total - reused} 個重新處理")
+    return results
+
+def run_pipeline_shm(tiles, download_workers, detect_workers, rate, manifest=None, checkpoint=None, tile_size=256):
+    """
+    與 run_pipeline 相同，但下載執行緒直接把圖磚解碼進共享記憶體，
+    worker process 讀同一塊記憶體，不 pickle numpy 陣列
+    """
+    bucket = TokenBucket(rate)
+    results = {}
+    total = len(tiles)
+    done = 0
+    reused = 0
+    downloaded_bytes = 0
+    start = time.time()
+    
+    # 每個 worker 留幾個 slot 排隊，slot 用完時下載會暫停（背壓）
+    n_slots = max(detect_workers, 1) * 4
+    
+    # 偵測出錯或中斷時設定，讓還在等 slot 的下載執行緒放棄
+    cancel = threading.Event()
+    
+    with shm_pool.SharedImageSlots(n_slots, (tile_size, tile_size, 3)) as buffers:
+        def fetch(tile):
+            if cancel.is_set():
+                return tile, None, None, 0, None, None
+            bucket.acquire()
+            tx, ty, zoom, bounds = tile
+            data, cached, info = fetch_incremental(tx, ty, zoom, manifest)
+            image = decode_tile(data)
+            if image is None:
+                return tile, None, None, 0, cached, info
+            h, w = min(image.shape[0], tile_size), min(image.shape[1], tile_size)
+            slot = buffers.acquire(cancel=cancel)
+            if slot is None:
+                return tile, None, None, 0, None, None
+            buffers.array(slot)[:h, :w] = image[:h, :w]
+            return tile, slot, (h, w), len(data), cached, info
+        
+        with ThreadPoolExecutor(max_workers=download_workers) as io_pool, \
+                ProcessPoolExecutor(max_workers=detect_workers, initializer=shm_pool.attach,
+                                    initargs=buffers.initargs()) as cpu_pool:
+            pending = {io_pool.submit(fetch, t) for t in tiles}
+            detections = {}
+            
+            try:
+                while pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        if fut in detections:
+                            tx, ty, info = detections.pop(fut)
+                            results[(tx, ty)] = fut.result()
+                            record_tile(tx, ty, results[(tx, ty)], info, manifest, checkpoint)
+                            done += 1
+                            if done % 50 == 0 or done == total:
+                                elapsed = time.time() - start
+                                print(f"[{done}/{total}] {done / elapsed:.1f} 圖磚/秒, "
+                                      f"已下載 {downloaded_bytes / 1024 / 1024:.1f} MB")
+                            continue
+                    
+                        (tx, ty, zoom, bounds), slot, hw, size, cached, info = fut.result()
+                        if cached is not None:
+                            results[(tx, ty)] = cached
+                            reused += 1
+                            record_tile(tx, ty, cached, None, None, checkpoint)
+                        if slot is None:
+                            done += 1
+                            continue
+                        downloaded_bytes += size
+                        det = cpu_pool.submit(detect_tile_shm, slot, hw[0], hw[1], bounds)
+                        # 偵測完就把 slot 還回去
+                        det.add_done_callback(lambda f, slot=slot: buffers.release(slot))
+                        detections[det] = (tx, ty, info)
+                        pending.add(det)
+            except BaseException:
+                # 離開 with 時會等所有下載執行緒結束：先叫醒等 slot 的，還沒開始的直接取消，否則會永遠卡住
+                cancel.set()
+                for fut in pending:
+                    fut.cancel()
+                raise
+    
+    elapsed = time.time() - start
+    print(f"下載+偵測耗時 {elapsed:.1f} 秒（{total / max(elapsed, 1e-9):.1f} 圖磚/秒）")
+    if manifest is not None:
+        print(f"增量: {reused} 個圖磚沿用上次結果，{total - reused} 個重新處理")
+    return results
+
 def main():
+    parser = argparse.ArgumentParser(description="八仙段土地邊界偵測")
+    parser.add_argument("--download-workers", type=int, default=8, help="同時下載的圖磚數")
+    parser.add_argument("--detect-workers", type=int, default=os.cpu_count(), help="OpenCV 偵測的 process 數")
+    parser.add_argument("--rate", type=float, default=10, help="每秒最多下載幾個圖磚（0 = 不限）")
+    parser.add_argument("--shm", action="store_true", help="影像用共享記憶體傳給 worker（解碼在下載執行緒）")
+    parser.add_argument("--mosaic", type=int, default=0, help="拼接 N x N 個圖磚再偵測（0 = 逐張偵測）")
+    parser.add_argument("--no-merge", action="store_true", help="不合併跨圖磚接縫的碎片")
+    parser.add_argument("--overlap", type=int, default=128, help="拼接區塊之間重疊的像素（需大於田塊寬度的一半）")
+    parser.add_argument("--bbox", help="偵測範圍 min_lon,min_lat,max_lon,max_lat（預設整個八仙段）")
+    parser.add_argument("--polygon", help="偵測範圍 GeoJSON 檔（Polygon / MultiPolygon / Feature / FeatureCollection）")
+    parser.add_argument("--resume", action="store_true", help="從上次中斷的檢查點續跑")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="檢查點目錄（完成後刪除）")
+    parser.add_argument("--full", action="store_true", help="忽略 manifest，所有圖磚重新下載偵測")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="增量偵測的 manifest 檔")
+    parser.add_argument("--simplify", type=float, default=polygon_simplify.DEFAULT_TOLERANCE_M,
+                        help="多邊形簡化容許誤差（公尺，0 = 不簡化）")
+    parser.add_argument("--simplify-method", choices=sorted(polygon_simplify.METHODS), default="dp",
+                        help="dp = Douglas-Peucker, vw = Visvalingam-Whyatt")
+    parser.add_argument("--precision", type=int, default=polygon_simplify.DEFAULT_PRECISION,
+                        help="座標小數位數（7 約 1 公分）")
+    parser.add_argument("--indent", type=int, default=None, help="JSON 縮排（預設不縮排）")
+    args = parser.parse_args()
+    
     print("=== 八仙段土地邊界偵測 ===")
-    print(f"範圍: lat {MIN_LAT:.4f}~{MAX_LAT:.4f}, lon {MIN_LON:.4f}~{MAX_LON:.4f}")
-    
-    # 計算需要的圖磚
-    min_tx, min_ty = lat_lon_to_tile(MAX_LAT, MIN_LON, ZOOM)
-    max_tx, max_ty = lat_lon_to_tile(MIN_LAT, MAX_LON, ZOOM)
-    
-    print(f"圖磚範圍: x={min_tx}~{max_tx}, y={min_ty}~{max_ty}")
-    
-    tiles = []
-    for y in range(min_ty, max_ty + 1):  # Y 遞增
-        for x in range(min_tx, max_tx + 1):
-            # 計算這個圖磚的地理邊界
-            lat1, lon1 = tile_to_lat_lon(x, y, ZOOM)
-            lat2, lon2 = tile_to_lat_lon(x + 1, y + 1, ZOOM)
-            bounds = {
-                'min_lon': lon1,
-                'max_lat': lat1,
-                'max_lon': lon2,
-                'min_lat': lat2
-            }
-            tiles.append((x, y, ZOOM, bounds))
+    
+    area = None
+    if args.polygon:
+        with open(args.polygon, encoding='utf-8') as f:
+            area = Area.from_geojson(json.load(f))
+    elif args.bbox:
+        area = Area.parse_bbox(args.bbox)
+    
+    if area is not None:
+        min_lon, min_lat, max_lon, max_lat = area.bounds
+        print(f"範圍: lat {min_lat:.4f}~{max_lat:.4f}, lon {min_lon:.4f}~{max_lon:.4f}（{len(area.polygons)} 個多邊形）")
+        keys = area.tiles(ZOOM)
+        grid = TileGrid.from_tiles(keys, ZOOM)
+    else:
+        print(f"範圍: lat {MIN_LAT:.4f}~{MAX_LAT:.4f}, lon {MIN_LON:.4f}~{MAX_LON:.4f}")
+        # 計算需要的圖磚
+        grid = TileGrid.from_bbox(MIN_LON, MIN_LAT, MAX_LON, MAX_LAT, ZOOM)
+        print(f"圖磚範圍: x={grid.min_tx}~{grid.max_tx}, y={grid.min_ty}~{grid.max_ty}")
+        keys = grid.tiles()  # Y 遞增
+    
+    # 圖磚的地理邊界直接查預先算好的邊界表
+    tiles = [(x, y, ZOOM, grid.bounds(x, y)) for x, y in keys]
     
     print(f"總共 {len(tiles)} 個圖磚")
     
+    # 檢查點：同樣的參數、模式與圖磚才能續跑
+    header = {
+        "params": params_digest(DETECT_PARAMS),
+        "mosaic": args.mosaic,
+        "overlap": args.overlap if args.mosaic > 0 else None,
+        "tiles": params_digest([[x, y] for x, y, _, _ in tiles]),
+    }
+    try:
+        checkpoint = RunCheckpoint(args.checkpoint_dir, header, resume=args.resume)
+    except CheckpointMismatch as e:
+        print(e)
+        return
+    
     # 下載並處理所有圖磚
+    try:
+        if args.mosaic > 0:
+            results = run_mosaic_pipeline(tiles, args.download_workers, args.detect_workers, args.rate,
+                                          args.mosaic, args.overlap, checkpoint)
+        else:
+            # 逐張偵測的結果只跟該圖磚有關，可以增量；拼接模式每次都完整重跑
+            manifest = DetectionManifest(args.manifest, DETECT_PARAMS, load=not args.full)
+            if len(manifest):
+                print(f"manifest: {len(manifest)} 個圖磚的上次結果")
+            
+            # 檢查點裡已完成的圖磚直接還原
+            results = {}
+            for unit, (restored, info) in checkpoint.completed.items():
+                results.update(restored)
+                if info:
+                    for (tx, ty), coords in restored.items():
+                        manifest.update(tx, ty, info[0], coords, info[1], info[2])
+            pending = [t for t in tiles if (t[0], t[1]) not in results]
+            if results:
+                print(f"續跑: {len(results)} 個圖磚已完成，剩 {len(pending)} 個")
+            
+            pipeline = run_pipeline_shm if args.shm else run_pipeline
+            results.update(pipeline(pending, args.download_workers, args.detect_workers, args.rate,
+                                    manifest, checkpoint))
+            Path(args.manifest).parent.mkdir(parents=True, exist_ok=True)
+            manifest.save()
+    except KeyboardInterrupt:
+        checkpoint.close()
+        print(f"\n已中斷，完成的部分已存在 {args.checkpoint_dir}，加上 --resume 可續跑")
+        raise SystemExit(130)
+    
     all_features = []
     
-    for i, (tx, ty, zoom, bounds) in enumerate(tiles):
-        print(f"[{i+1}/{len(tiles)}] 處理圖磚 ({tx}, {ty})...")
-        
-        tile = download_tile(tx, ty, zoom)
-        if tile is None:
+    # 依圖磚順序輸出，結果與序列執行相同
+    for tx, ty, zoom, bounds in tiles:
+        coords = results.get((tx, ty))
+        if not coords:
             continue
         
-        contours = detect_boundaries_in_image(tile)
-        
-        if contours:
-            coords = image_to_geojson_contours(contours, tile.shape,
-                bounds['min_lon'], bounds['min_lat'],
-                bounds['max_lon'], bounds['max_lat'])
-            
-            for j, c in enumerate(coords):
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Polygon",
-                        "coordinates": [c]
-                    },
-                    "properties": {
-                        "id": f"{tx}_{ty}_{j}",
-                        "tile": f"{tx}_{ty}"
-                    }
+        for j, c in enumerate(coords):
+            feature = {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [c]
+                },
+                "properties": {
+                    "id": f"{tx}_{ty}_{j}",
+                    "tile": f"{tx}_{ty}"
                 }
-                all_features.append(feature)
-            
-            print(f"  -> 偵測到 {len(coords)} 塊")
-        
-        time.sleep(0.1)  # 避免請求太快
+            }
+            all_features.append(feature)
+    
+    # 被圖磚邊界切開的同一塊田合併回一個 feature
+    if not args.no_merge:
+        before = len(all_features)
+        all_features = merge_seams(all_features, ZOOM)
+        print(f"接縫合併: {before} 塊 -> {len(all_features)} 塊")
+    
+    # 邊緣圖磚會超出範圍，只留下代表點在範圍內的土地
+    if area is not None:
+        all_features = filter_features(all_features, area)
+    
+    # 在簡化前以完整精度的多邊形計算面積（平方公尺、坪、分）
+    add_area_properties(all_features)
     
     # 儲存結果
     geojson = {
@@ -203,11 +691,32 @@ def main():
         "features": all_features
     }
     
+    # 簡化前以原本的格式（indent=2、完整精度）估算大小，作為比較基準
+    bytes_before = len(json.dumps(geojson, indent=2, ensure_ascii=False, default=json_default).encode('utf-8'))
+    stats = polygon_simplify.simplify_features(all_features, args.simplify, args.simplify_method, args.precision)
+    
     output_path = Path(OUTPUT_FILE)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
+    separators = (',', ':') if args.indent is None else None
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(geojson, f, indent=2, ensure_ascii=False)
+        json.dump(geojson, f, indent=args.indent, separators=separators, ensure_ascii=False, default=json_default)
+    polygon_simplify.print_report(stats, bytes_before, output_path.stat().st_size)
+    # 有單位（圖磚或區塊）沒抓到時保留檢查點，--resume 只重跑缺的部分
+    if args.mosaic > 0:
+        units = {f"chunk_{i}" for i in range(len(build_chunks(tiles, args.mosaic, args.overlap)))}
+    else:
+        units = {f"{x}_{y}" for x, y, _, _ in tiles}
+    missing = units - set(checkpoint.completed)
+    if missing:
+        checkpoint.close()
+        print(f"{len(missing)} 個{'區塊' if args.mosaic > 0 else '圖磚'}沒有完成，"
+              f"檢查點保留在 {args.checkpoint_dir}，加上 --resume 可重抓")
+    else:
+        checkpoint.finish()
+    
+    if archive:
+        archive.close()
     
     print(f"\n完成！")
     print(f"總共偵測到: {len(all_features)} 塊土地")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+增量偵測的 manifest
+記錄每個圖磚的影像雜湊、上游驗證值（ETag / Last-Modified）、偵測參數與偵測結果；
+重跑時影像與參數都沒變的圖磚直接沿用結果，不用再下載或偵測
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from geo import json_default
+
+MANIFEST_VERSION = 1
+
+
+def params_digest(params):
+    """偵測參數的雜湊（key 順序無關）"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def tile_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _key(tx, ty):
+    return f"{tx}_{ty}"
+
+
+class DetectionManifest:
+    """
+    {"version": 1, "tiles": {"{tx}_{ty}": {"sha256", "etag", "last_modified", "params", "coords"}}}
+    coords 是該圖磚偵測出的多邊形（逐張偵測的原始結果，尚未接縫合併或簡化）
+    """
+
+    def __init__(self, path, params, load=True):
+        self.path = path
+        self.params = params_digest(params)
+        self.tiles = {}
+        if load and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.tiles = data.get("tiles", {})
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def _current(self, tx, ty):
+        """參數相同的紀錄才能沿用"""
+        entry = self.tiles.get(_key(tx, ty))
+        if entry and entry.get("params") == self.params:
+            return entry
+        return None
+
+    def validators(self, tx, ty):
+        """上次下載時的 (etag, last_modified)，用於條件式請求"""
+        entry = self._current(tx, ty)
+        if entry is None:
+            return None, None
+        return entry.get("etag"), entry.get("last_modified")
+
+    def lookup(self, tx, ty, digest=None):
+        """
+        可沿用的偵測結果（座標陣列列表），沒有就回傳 None
+        digest 為 None 表示上游回 304，只要參數相同就沿用
+        """
+        entry = self._current(tx, ty)
+        if entry is None or (digest is not None and entry.get("sha256") != digest):
+            return None
+        return [np.asarray(c, dtype=np.float64) for c in entry["coords"]]
+
+    def update(self, tx, ty, digest, coords, etag=None, last_modified=None):
+        self.tiles[_key(tx, ty)] = {
+            "sha256": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+            "params": self.params,
+            "coords": coords,
+        }
+
+    def save(self):
+        """寫到暫存檔再換名，中途中斷不會留下壞掉的 manifest"""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "tiles": self.tiles}, f,
+                      separators=(",", ":"), default=json_default)
+        os.replace(tmp, self.path)
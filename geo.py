@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Web Mercator 圖磚 / 像素 / 經緯度換算
+每個函式都有純量版（單一點）與 numpy 批次版（(N, 2) 陣列），
+偵測、接縫合併、範圍、預熱等各階段共用同一套公式
+
+用法: python geo.py        # 純量 vs 批次的微基準測試
+"""
+
+import math
+
+import numpy as np
+
+TILE_SIZE = 256
+# 赤道周長（公尺），Web Mercator 在緯度 lat 的地面解析度要乘上 cos(lat)
+EARTH_CIRCUMFERENCE = 40075016.686
+# 局部平面近似：緯度 1 度約 110.574 km，經度 1 度約 111.320 km * cos(lat)
+M_PER_DEG_LAT = 110574.0
+M_PER_DEG_LON = 111320.0
+
+
+# ---- 純量 ----
+
+def lat_lon_to_tile(lat, lon, zoom):
+    """經緯度轉所在圖磚 (x, y)"""
+    n = 2.0 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def tile_to_lat_lon(x, y, zoom):
+    """圖磚座標（可含小數）轉經緯度，整數時是圖磚左上角"""
+    n = 2.0 ** zoom
+    lon = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lat, lon
+
+
+def tile_bbox(x, y, zoom):
+    """圖磚的邊界 (min_lon, min_lat, max_lon, max_lat)"""
+    max_lat, min_lon = tile_to_lat_lon(x, y, zoom)
+    min_lat, max_lon = tile_to_lat_lon(x + 1, y + 1, zoom)
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def tile_to_pixel(x, y, tile_size=TILE_SIZE):
+    """圖磚左上角的全域像素座標"""
+    return x * tile_size, y * tile_size
+
+
+def pixel_to_tile(px, py, tile_size=TILE_SIZE):
+    """全域像素座標所在的圖磚"""
+    return int(px // tile_size), int(py // tile_size)
+
+
+def meters_per_pixel(lat, zoom, tile_size=TILE_SIZE):
+    """緯度 lat 上一個像素的地面距離（公尺）"""
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(lat)) / (tile_size * 2.0 ** zoom)
+
+
+def meters_to_pixels(meters, lat, zoom, tile_size=TILE_SIZE):
+    return meters / meters_per_pixel(lat, zoom, tile_size)
+
+
+def pixels_to_meters(pixels, lat, zoom, tile_size=TILE_SIZE):
+    return pixels * meters_per_pixel(lat, zoom, tile_size)
+
+
+def meters_to_tile_offset(meters, lat, zoom):
+    """公尺換算成圖磚數"""
+    return meters_to_pixels(meters, lat, zoom) / TILE_SIZE
+
+
+# ---- numpy 批次 ----
+
+def lon_lat_to_tile_xy(coords, zoom):
+    """經緯度 (N, 2) 轉圖磚座標（含小數）(N, 2)"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    n = 2.0 ** zoom
+    x = (coords[:, 0] + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(np.radians(coords[:, 1]))) / math.pi) / 2.0 * n
+    return np.column_stack([x, y])
+
+
+def tile_xy_to_lon_lat(xy, zoom):
+    """圖磚座標（含小數）(N, 2) 轉經緯度 (N, 2)"""
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    n = 2.0 ** zoom
+    lon = xy[:, 0] / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * xy[:, 1] / n))))
+    return np.column_stack([lon, lat])
+
+
+def lon_lat_to_tiles(coords, zoom):
+    """經緯度 (N, 2) 所在的圖磚 (N, 2) int"""
+    return np.floor(lon_lat_to_tile_xy(coords, zoom)).astype(np.int64)
+
+
+def lon_lat_to_pixels(coords, zoom, tile_size=TILE_SIZE):
+    """經緯度 (N, 2) 轉全域像素座標 (N, 2)"""
+    return lon_lat_to_tile_xy(coords, zoom) * tile_size
+
+
+def pixels_to_lon_lat(pixels, zoom, tile_size=TILE_SIZE):
+    """全域像素座標 (N, 2) 轉經緯度 (N, 2)"""
+    return tile_xy_to_lon_lat(np.asarray(pixels, dtype=np.float64) / tile_size, zoom)
+
+
+def meters_per_pixel_array(lats, zoom, tile_size=TILE_SIZE):
+    """每個緯度上一個像素的地面距離（公尺）"""
+    return EARTH_CIRCUMFERENCE * np.cos(np.radians(lats)) / (tile_size * 2.0 ** zoom)
+
+
+def row_latitudes(h, min_lat, max_lat):
+    """影像每一列像素（0..h）的緯度；Web Mercator 在 y 方向不是線性，要在投影座標內插"""
+    top = np.arcsinh(np.tan(np.radians(max_lat)))
+    bottom = np.arcsinh(np.tan(np.radians(min_lat)))
+    my = top + np.arange(h + 1) / h * (bottom - top)
+    return np.degrees(np.arctan(np.sinh(my)))
+
+
+def image_to_lon_lat(pts, img_shape, min_lon, min_lat, max_lon, max_lat):
+    """影像像素座標 (N, 2) int 轉經緯度 (N, 2)；影像涵蓋 (min_lon..max_lon, min_lat..max_lat)"""
+    h, w = img_shape[:2]
+    pts = np.asarray(pts).reshape(-1, 2)
+    lon = min_lon + pts[:, 0] * ((max_lon - min_lon) / w)
+    lat = row_latitudes(h, min_lat, max_lat)[pts[:, 1]]
+    return np.column_stack([lon, lat])
+
+
+# ---- 圖磚邊界表 ----
+
+class TileGrid:
+    """
+    一塊矩形圖磚範圍 x=min_tx..max_tx, y=min_ty..max_ty（含）
+    預先算好每一欄的經度與每一列的緯度邊界，查任何圖磚的邊界都只是查表
+    """
+
+    def __init__(self, min_tx, min_ty, max_tx, max_ty, zoom):
+        self.min_tx, self.min_ty = min_tx, min_ty
+        self.max_tx, self.max_ty = max_tx, max_ty
+        self.zoom = zoom
+        n = 2.0 ** zoom
+        # lon_edges[i] 是第 min_tx + i 欄的左邊界，lat_edges[j] 是第 min_ty + j 列的上邊界
+        self.lon_edges = np.arange(min_tx, max_tx + 2) / n * 360.0 - 180.0
+        ys = np.arange(min_ty, max_ty + 2)
+        self.lat_edges = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * ys / n))))
+
+    @classmethod
+    def from_bbox(cls, min_lon, min_lat, max_lon, max_lat, zoom):
+        min_tx, min_ty = lat_lon_to_tile(max_lat, min_lon, zoom)
+        max_tx, max_ty = lat_lon_to_tile(min_lat, max_lon, zoom)
+        return cls(min_tx, min_ty, max_tx, max_ty, zoom)
+
+    @classmethod
+    def from_tiles(cls, tiles, zoom):
+        """涵蓋 [(x, y), ...] 的最小矩形"""
+        xs = [t[0] for t in tiles]
+        ys = [t[1] for t in tiles]
+        return cls(min(xs), min(ys), max(xs), max(ys), zoom)
+
+    @property
+    def shape(self):
+        """(列數, 欄數)"""
+        return self.max_ty - self.min_ty + 1, self.max_tx - self.min_tx + 1
+
+    def __len__(self):
+        rows, cols = self.shape
+        return rows * cols
+
+    def __contains__(self, xy):
+        x, y = xy
+        return self.min_tx <= x <= self.max_tx and self.min_ty <= y <= self.max_ty
+
+    def tiles(self):
+        """範圍內所有圖磚 (x, y)，Y 遞增、X 遞增"""
+        return [(x, y) for y in range(self.min_ty, self.max_ty + 1)
+                for x in range(self.min_tx, self.max_tx + 1)]
+
+    def bbox(self, x, y):
+        """圖磚邊界 (min_lon, min_lat, max_lon, max_lat)"""
+        i, j = x - self.min_tx, y - self.min_ty
+        return (float(self.lon_edges[i]), float(self.lat_edges[j + 1]),
+                float(self.lon_edges[i + 1]), float(self.lat_edges[j]))
+
+    def bounds(self, x, y):
+        """圖磚邊界（dict 格式，給偵測流程用）"""
+        min_lon, min_lat, max_lon, max_lat = self.bbox(x, y)
+        return {'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon, 'min_lat': min_lat}
+
+    def extent(self):
+        """整個範圍的邊界 (min_lon, min_lat, max_lon, max_lat)"""
+        return (float(self.lon_edges[0]), float(self.lat_edges[-1]),
+                float(self.lon_edges[-1]), float(self.lat_edges[0]))
+
+    def bbox_table(self):
+        """所有圖磚的邊界 (rows, cols, 4) 陣列：min_lon, min_lat, max_lon, max_lat"""
+        rows, cols = self.shape
+        table = np.empty((rows, cols, 4))
+        table[:, :, 0] = self.lon_edges[:-1][None, :]
+        table[:, :, 1] = self.lat_edges[1:][:, None]
+        table[:, :, 2] = self.lon_edges[1:][None, :]
+        table[:, :, 3] = self.lat_edges[:-1][:, None]
+        return table
+
+
+# ---- GeoJSON 輸出 ----
+
+def json_default(obj):
+    """json.dump 遇到 numpy 陣列或純量（np.float64、np.int64 等）時轉成 Python 型別"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _bench():
+    import timeit
+
+    rng = np.random.default_rng(0)
+    n = 100000
+    coords = np.column_stack([rng.uniform(121.777, 121.7935, n), rng.uniform(24.6538, 24.666, n)])
+    pairs = coords.tolist()
+    zoom = 19
+
+    def report(name, fn, number):
+        t = timeit.timeit(fn, number=number) / number
+        print(f"{name:<36} {t * 1000:9.2f} ms  {n / t / 1e6:8.2f} M 點/秒")
+
+    print(f"{n} 個點, zoom {zoom}")
+    report("lat_lon_to_tile (純量迴圈)", lambda: [lat_lon_to_tile(lat, lon, zoom) for lon, lat in pairs], 3)
+    report("lon_lat_to_tiles (批次)", lambda: lon_lat_to_tiles(coords, zoom), 20)
+    report("tile_to_lat_lon (純量迴圈)", lambda: [tile_to_lat_lon(x, y, zoom) for x, y in pairs], 3)
+    report("tile_xy_to_lon_lat (批次)", lambda: tile_xy_to_lon_lat(coords, zoom), 20)
+    pixels = lon_lat_to_pixels(coords, zoom)
+    report("lon_lat_to_pixels (批次)", lambda: lon_lat_to_pixels(coords, zoom), 20)
+    report("pixels_to_lon_lat (批次)", lambda: pixels_to_lon_lat(pixels, zoom), 20)
+
+    grid = TileGrid.from_bbox(121.7770, 24.6538, 121.7935, 24.6660, zoom)
+    keys = grid.tiles()
+    t = timeit.timeit(lambda: [tile_bbox(x, y, zoom) for x, y in keys], number=20) / 20
+    print(f"tile_bbox x {len(keys)} 圖磚 (純量)          {t * 1000:9.3f} ms")
+    t = timeit.timeit(lambda: [grid.bbox(x, y) for x, y in keys], number=20) / 20
+    print(f"TileGrid.bbox x {len(keys)} 圖磚 (查表)      {t * 1000:9.3f} ms")
+    t = timeit.timeit(grid.bbox_table, number=200) / 200
+    print(f"TileGrid.bbox_table ({len(keys)} 圖磚)        {t * 1000:9.3f} ms")
+
+    # 純量與批次結果一致
+    scalar = np.array([lat_lon_to_tile(lat, lon, zoom) for lon, lat in pairs[:1000]])
+    assert np.array_equal(scalar, lon_lat_to_tiles(coords[:1000], zoom))
+    assert all(np.allclose(grid.bbox(x, y), tile_bbox(x, y, zoom)) for x, y in keys)
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+背景工作佇列
+送出工作立即拿到 job id，由固定數量的 worker 執行緒依序處理；
+佇列有上限（滿了就拒絕，由呼叫端回 503），可取消，並回報每個工作的進度
+"""
+
+import time
+import uuid
+import queue
+import threading
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """排隊中的工作已達上限"""
+
+
+class Cancelled(Exception):
+    """工作在執行中被取消（由 job.check() 丟出）"""
+
+
+class Job:
+    """
+    一個背景工作；fn(job) 在 worker 執行緒中執行，
+    用 job.set_total() / job.advance() 回報進度，定期呼叫 job.check() 以便能被取消
+    """
+
+    def __init__(self, fn, params=None):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.params = params or {}
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+
+    def _update(self, **fields):
+        with self._cond:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._cond.notify_all()
+
+    def set_total(self, total):
+        self._update(total=total)
+
+    def advance(self, n=1):
+        with self._cond:
+            self.done += n
+            self.version += 1
+            self._cond.notify_all()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def cancel(self):
+        """要求取消；排隊中的工作直接結束，執行中的在下一次 check() 停下"""
+        self._cancel.set()
+        with self._cond:
+            if self.status == QUEUED:
+                self.status = CANCELLED
+                self.finished_at = time.time()
+                self.version += 1
+                self._cond.notify_all()
+
+    def wait(self, version, timeout=None):
+        """等到狀態版本超過 version（或逾時），回傳目前版本"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > version or self.finished, timeout)
+            return self.version
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "params": self.params,
+                "progress": {"done": self.done, "total": self.total},
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobQueue:
+    """workers 個執行緒處理工作，最多 max_queued 個工作排隊，完成的工作保留 max_finished 個"""
+
+    def __init__(self, workers=2, max_queued=16, max_finished=100):
+        self.max_finished = max_finished
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn, params=None):
+        """排入工作並回傳 Job；佇列已滿時丟出 QueueFull"""
+        job = Job(fn, params)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job:
+            job.cancel()
+        return job
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        if len(finished) > self.max_finished:
+            finished.sort(key=lambda j: j.finished_at)
+            for job in finished[:len(finished) - self.max_finished]:
+                del self._jobs[job.id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.cancelled:
+                    continue
+                job._update(status=RUNNING, started_at=time.time())
+                try:
+                    result = job.fn(job)
+                except Cancelled:
+                    job._update(status=CANCELLED, finished_at=time.time())
+                except Exception as e:
+                    job._update(status=FAILED, error=str(e), finished_at=time.time())
+                else:
+                    job._update(status=DONE, result=result, finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": len(self._threads),
+            "queued": self._queue.qsize(),
+            "max_queued": self._queue.maxsize,
+            "jobs": counts,
+        }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+土地面積：單位換算、591 面積字串解析、多邊形的橢球面積
+多邊形面積在 WGS84 的等面積（authalic）球面上計算：緯度換成等面積緯度後用梯形公式，
+所有環放在同一個座標陣列（加上每個環的起點 offsets），一次算完；
+偵測結果用 add_area_properties() 一次替所有 feature 加上平方公尺、坪、分
+
+用法: python land_area.py        # 與局部平面近似比較的微基準測試
+"""
+
+import re
+import math
+
+import numpy as np
+
+# 1 坪 = 400/121 平方公尺；1 分 = 293.4 坪（PRD）；1 甲 = 10 分
+M2_PER_PING = 400.0 / 121.0
+PING_PER_FEN = 293.4
+PING_PER_JIA = PING_PER_FEN * 10
+
+# WGS84
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+_E2 = WGS84_F * (2 - WGS84_F)
+_E = math.sqrt(_E2)
+
+# 面積字串的單位 -> 換算成坪的倍數
+UNITS = {
+    "坪": 1.0,
+    "平方公尺": 1 / M2_PER_PING,
+    "㎡": 1 / M2_PER_PING,
+    "m²": 1 / M2_PER_PING,
+    "m2": 1 / M2_PER_PING,
+    "公頃": 10000 / M2_PER_PING,
+    "分": PING_PER_FEN,
+    "甲": PING_PER_JIA,
+}
+_AREA_RE = re.compile(r"^\s*([0-9][0-9,]*(?:\.[0-9]+)?)\s*(\S*)\s*$")
+
+
+def m2_to_ping(m2):
+    return m2 / M2_PER_PING
+
+
+def ping_to_fen(ping):
+    return ping / PING_PER_FEN
+
+
+def parse_area(value):
+    """591 的面積欄位（例如 "399.61坪"）換算成坪；數字視為坪，無法解析時回傳 nan"""
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _AREA_RE.match(str(value))
+    unit = m.group(2) or "坪" if m else None
+    if unit not in UNITS:
+        return math.nan
+    return float(m.group(1).replace(",", "")) * UNITS[unit]
+
+
+def parse_areas(values):
+    """面積欄位列表 -> 坪 (N,) 陣列"""
+    return np.fromiter((parse_area(v) for v in values), dtype=np.float64, count=len(values))
+
+
+def _q(sin_phi):
+    """等面積緯度的 q 函數"""
+    e_sin = _E * sin_phi
+    return (1 - _E2) * (sin_phi / (1 - e_sin * e_sin) - np.log((1 - e_sin) / (1 + e_sin)) / (2 * _E))
+
+
+_QP = float(_q(np.float64(1.0)))
+# 等面積球半徑
+AUTHALIC_RADIUS = WGS84_A * math.sqrt(_QP / 2)
+
+
+def ring_areas_m2(coords, offsets):
+    """
+    多個環的面積（平方公尺）
+    coords: 所有環串接的經緯度 (M, 2)；offsets: 每個環的起點，長度為環數 + 1
+    環可以是封閉（首尾相同）或不封閉；回傳 (環數,) 陣列，方向不影響（取絕對值）
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    areas = np.zeros(len(lengths))
+    valid = lengths >= 3
+    if not valid.any():
+        return areas
+    starts, lengths = starts[valid], lengths[valid]
+    # 只取有效的環，重新串接
+    first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    index = np.repeat(starts - first, lengths) + np.arange(lengths.sum())
+    lon = np.radians(coords[index, 0])
+    # sin(等面積緯度) = q / qp
+    s = _q(np.sin(np.radians(coords[index, 1]))) / _QP
+    # 減去每個環第一點的值，避免小面積時大數相消的誤差（環的 Δλ 總和為 0，不影響結果）
+    lon = lon - np.repeat(lon[first], lengths)
+    s = s - np.repeat(s[first], lengths)
+    # 每個頂點的下一個頂點（環的最後一點接回第一點）
+    nxt = np.arange(1, len(index) + 1)
+    nxt[first + lengths - 1] = first
+    terms = (lon[nxt] - lon) * (s + s[nxt])
+    areas[valid] = np.abs(np.add.reduceat(terms, first)) * AUTHALIC_RADIUS ** 2 / 2
+    return areas
+
+
+def rings_to_buffer(rings):
+    """環的列表 -> (coords, offsets)"""
+    lengths = [len(r) for r in rings]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    coords = np.vstack([np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings]) if rings else np.empty((0, 2))
+    return coords, offsets
+
+
+def polygon_areas_m2(features):
+    """Polygon feature 列表各自的面積（外環減去洞），所有環一次計算；不是 Polygon 的為 0"""
+    rings, owner, sign = [], [], []
+    for i, feature in enumerate(features):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "Polygon":
+            continue
+        for k, ring in enumerate(geometry["coordinates"]):
+            rings.append(ring)
+            owner.append(i)
+            sign.append(1.0 if k == 0 else -1.0)
+    areas = np.zeros(len(features))
+    if rings:
+        np.add.at(areas, owner, ring_areas_m2(*rings_to_buffer(rings)) * sign)
+    return areas
+
+
+def add_area_properties(features):
+    """每個 feature 的 properties 加上 area_m2、area_ping、area_fen"""
+    m2 = polygon_areas_m2(features)
+    ping = m2_to_ping(m2)
+    fen = ping_to_fen(ping)
+    for feature, a, p, f in zip(features, np.round(m2, 2).tolist(), np.round(ping, 2).tolist(),
+                                np.round(fen, 4).tolist()):
+        feature.setdefault("properties", {}).update(area_m2=a, area_ping=p, area_fen=f)
+    return features
+
+
+def _bench():
+    import time
+
+    # 約 1 公頃的方塊，與經緯線圍成的格子（解析解 Δλ·R²·(sinβ2 - sinβ1)）
+    lat0 = 24.66
+    dlat = 100 / 110574.0
+    dlon = 100 / (111320.0 * math.cos(math.radians(lat0)))
+    square = [(121.78, lat0), (121.78 + dlon, lat0), (121.78 + dlon, lat0 + dlat), (121.78, lat0 + dlat)]
+    print(f"約 100 m x 100 m 的方塊: {ring_areas_m2(*rings_to_buffer([square]))[0]:.1f} m²")
+    cell = [(121, 24), (122, 24), (122, 25), (121, 25), (121, 24)]
+    area = ring_areas_m2(*rings_to_buffer([cell]))[0]
+    exact = math.radians(1) * AUTHALIC_RADIUS ** 2 * float(_q(np.sin(np.radians(25))) - _q(np.sin(np.radians(24)))) / _QP
+    print(f"121-122E, 24-25N 的格子: {area:.6e} m²（解析解 {exact:.6e}）")
+    assert abs(area / exact - 1) < 1e-9
+
+    rng = np.random.default_rng(0)
+    n = 100000
+    rings = []
+    for cx, cy in np.column_stack([rng.uniform(121.6, 121.9, n), rng.uniform(24.45, 24.9, n)]):
+        k = rng.integers(4, 12)
+        angle = np.sort(rng.uniform(0, 2 * np.pi, k))
+        r = rng.uniform(0.0002, 0.0005, k)
+        ring = np.column_stack([cx + r * np.cos(angle), cy + r * np.sin(angle)])
+        rings.append(np.vstack([ring, ring[:1]]))
+    coords, offsets = rings_to_buffer(rings)
+    t = time.perf_counter()
+    areas = ring_areas_m2(coords, offsets)
+    print(f"{n} 個多邊形（{len(coords)} 個頂點）: {(time.perf_counter() - t) * 1000:.1f} ms")
+
+    # 與局部平面（等距圓柱）近似的鞋帶公式比較
+    t = time.perf_counter()
+    flat = []
+    for ring in rings:
+        lat = math.radians(ring[:, 1].mean())
+        x = np.radians(ring[:, 0]) * WGS84_A * math.cos(lat)
+        y = np.radians(ring[:, 1]) * WGS84_A
+        flat.append(abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2)
+    print(f"逐個多邊形迴圈（平面近似）: {(time.perf_counter() - t) * 1000:.1f} ms，"
+          f"相對差異中位數 {np.median(np.abs(np.array(flat) / areas - 1)):.2%}")
+
+
+if __name__ == "__main__":
+    _bench()
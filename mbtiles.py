@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+MBTiles (SQLite) 圖磚封存
+一個檔案存一個圖層，可直接複製到現場筆電離線使用
+- (z, x, y) 唯一索引，tile_row 依 MBTiles 規格使用 TMS（y 軸翻轉）
+- 寫入先暫存，批次在同一個 transaction 寫入
+- 唯讀模式每個執行緒各自開連線，多個 worker 可同時讀
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from tile_cache import CacheEntry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+BATCH_SIZE = 256
+
+
+def tms_row(z, y):
+    """XYZ 的 y 與 MBTiles tile_row 互轉"""
+    return (1 << z) - 1 - y
+
+
+class MBTiles:
+    """單一圖層的 MBTiles 檔"""
+
+    def __init__(self, path, readonly=False, batch_size=BATCH_SIZE):
+        self.path = path
+        self.readonly = readonly
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._conns = []
+
+        if not readonly:
+            db = self._connect()
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            if self.readonly:
+                db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                     check_same_thread=False)
+            else:
+                db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            with self._lock:
+                self._conns.append(db)
+        return db
+
+    def read_tile(self, z, x, y):
+        """讀取圖磚內容，不存在回傳 None"""
+        with self._lock:
+            data = self._pending.get((z, x, y))
+        if data is not None:
+            return data
+        row = self._connect().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+            (z, x, tms_row(z, y))).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, zxy):
+        z, x, y = zxy
+        with self._lock:
+            if zxy in self._pending:
+                return True
+        row = self._connect().execute(
+            "SELECT 1 FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+            (z, x, tms_row(z, y))).fetchone()
+        return row is not None
+
+    def put(self, z, x, y, data):
+        """暫存寫入，累積到 batch_size 才真的寫檔"""
+        with self._lock:
+            self._pending[(z, x, y)] = data
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def write_tiles(self, tiles):
+        """一次寫入多個 (z, x, y, data)，同一個 transaction"""
+        if self.readonly:
+            raise sqlite3.OperationalError("archive opened read-only")
+        rows = [(z, x, tms_row(z, y), sqlite3.Binary(data)) for z, x, y, data in tiles]
+        if not rows:
+            return 0
+        db = self._connect()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return self.write_tiles((z, x, y, data) for (z, x, y), data in pending.items())
+
+    def get_metadata(self):
+        return dict(self._connect().execute("SELECT name, value FROM metadata"))
+
+    def set_metadata(self, **values):
+        db = self._connect()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                           [(k, str(v)) for k, v in values.items()])
+
+    def count(self):
+        with self._lock:
+            pending = len(self._pending)
+        return self._connect().execute("SELECT COUNT(*) FROM tiles").fetchone()[0] + pending
+
+    def size_bytes(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for db in conns:
+            db.close()
+        self._local = threading.local()
+
+
+class MBTilesStore:
+    """
+    與 TileCache 相同介面的 MBTiles 儲存，給 TileFetcher / tile_server / tile_warm 使用
+    archives: {layer: MBTiles}；封存裡的圖磚不會過期
+    """
+
+    def __init__(self, archives):
+        self.archives = archives
+        self.max_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, spec, readonly=False):
+        """spec 格式: '591=tiles_591.mbtiles,esri=esri.mbtiles'"""
+        archives = {}
+        for part in spec.split(","):
+            layer, path = part.split("=", 1)
+            archives[layer.strip()] = MBTiles(path.strip(), readonly=readonly)
+        return cls(archives)
+
+    def get(self, layer, z, x, y):
+        archive = self.archives.get(layer)
+        data = archive.read_tile(z, x, y) if archive is not None else None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is None:
+            return None
+        return CacheEntry(layer, z, x, y, data, hashlib.sha256(data).hexdigest(), 0, True)
+
+    def put(self, layer, z, x, y, data, etag=None, last_modified=None):
+        archive = self.archives.get(layer)
+        if archive is not None and not archive.readonly:
+            archive.put(z, x, y, data)
+        return CacheEntry(layer, z, x, y, data, hashlib.sha256(data).hexdigest(), time.time(), True)
+
+    def touch(self, layer, z, x, y, etag=None, last_modified=None):
+        pass
+
+    def contains(self, layer, z, x, y):
+        archive = self.archives.get(layer)
+        return archive is not None and (z, x, y) in archive
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "tiles": sum(a.count() for a in self.archives.values()),
+            "bytes": sum(a.size_bytes() for a in self.archives.values()),
+            "archives": {layer: a.path for layer, a in self.archives.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
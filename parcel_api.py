@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+地號查詢 API
+啟動時把地號中心點檔與田區邊界建成空間索引，之後點選地圖找最近地號、半徑查詢、
+框選 / 圈選、報價都不用掃過全部資料
+
+用法: PARCEL_FILES=baxian_centers.json PARCEL_BOUNDARIES=baxian_boundaries.json python parcel_api.py
+      PARCEL_STORE=baxian.parcels python parcel_api.py     # parcel_store.py 建立的二進位儲存
+"""
+
+import os
+import math
+import time
+
+from flask import Flask, request, jsonify
+
+from aoi import Area
+from parcel_index import ParcelIndex, MAX_RESULTS
+from parcel_select import ParcelSelector, load_footprints, MODES, INTERSECTS
+from parcel_store import ParcelStore
+from quote import QuoteEngine
+
+app = Flask(__name__)
+
+# 地號中心點檔（逗號分隔，可一次載入多個段）
+PARCEL_FILES = os.environ.get("PARCEL_FILES", "baxian_centers.json").split(",")
+# 田區邊界 GeoJSON（逗號分隔，空字串表示不載入）
+PARCEL_BOUNDARIES = [p for p in os.environ.get("PARCEL_BOUNDARIES", "baxian_boundaries.json").split(",") if p]
+# 二進位儲存目錄（設定後取代上面兩個 JSON）
+PARCEL_STORE = os.environ.get("PARCEL_STORE")
+MAX_K = 100
+MAX_RADIUS = 5000
+# 一次報價最多幾個地號
+MAX_QUOTE = 10000
+
+_t = time.perf_counter()
+if PARCEL_STORE:
+    store = ParcelStore(PARCEL_STORE)
+    parcels = ParcelIndex(store.records, store.coords())
+    selector = store.selector()
+else:
+    parcels = ParcelIndex.from_files(PARCEL_FILES)
+    selector = ParcelSelector(parcels.records, parcels.coords, load_footprints(PARCEL_BOUNDARIES))
+quotes = QuoteEngine(selector)
+print(f"載入 {len(parcels)} 筆地號、{len(selector.footprint_props)} 個邊界，"
+      f"建索引 {(time.perf_counter() - _t) * 1000:.1f} ms")
+
+
+class InvalidQuery(Exception):
+    """查詢參數不合法"""
+
+
+@app.errorhandler(InvalidQuery)
+def invalid_query(e):
+    return jsonify({"error": str(e)}), 400
+
+
+def get_point():
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if lat is None or lng is None:
+        raise InvalidQuery("lat and lng are required")
+    # float() 接受 nan / inf，進到索引會變成 500
+    if not (math.isfinite(lat) and math.isfinite(lng)):
+        raise InvalidQuery("lat and lng must be finite")
+    return lng, lat
+
+
+@app.route('/parcels/nearest')
+def nearest():
+    lng, lat = get_point()
+    k = request.args.get('k', 1, type=int)
+    if not 1 <= k <= MAX_K:
+        raise InvalidQuery(f"k must be 1..{MAX_K}")
+    idx, dist = parcels.nearest(lng, lat, k)
+    return jsonify({"parcels": parcels.describe(idx, dist)})
+
+
+@app.route('/parcels/within')
+def within():
+    lng, lat = get_point()
+    radius = request.args.get('radius', 50, type=float)
+    if not 0 < radius <= MAX_RADIUS:
+        raise InvalidQuery(f"radius must be 0..{MAX_RADIUS} m")
+    limit = request.args.get('limit', MAX_RESULTS, type=int)
+    if not 1 <= limit <= MAX_RESULTS:
+        raise InvalidQuery(f"limit must be 1..{MAX_RESULTS}")
+    idx, dist = parcels.within(lng, lat, radius, limit)
+    return jsonify({"count": len(idx), "parcels": parcels.describe(idx, dist)})
+
+
+def get_area(body=None):
+    """選取範圍：?bbox=min_lon,min_lat,max_lon,max_lat、?polygon=<GeoJSON>，或 POST 的 GeoJSON body"""
+    if body is None and request.method == 'POST':
+        body = request.get_json(silent=True)
+    try:
+        area = Area.from_request_args(request.args, body)
+    except ValueError as e:
+        raise InvalidQuery(f"invalid area: {e}")
+    if area is None:
+        raise InvalidQuery("bbox, polygon or a GeoJSON body is required")
+    return area
+
+
+def get_mode():
+    mode = request.args.get('mode', INTERSECTS)
+    if mode not in MODES:
+        raise InvalidQuery(f"mode must be one of {', '.join(MODES)}")
+    return mode
+
+
+@app.route('/parcels/select', methods=['GET', 'POST'])
+def select():
+    area = get_area()
+    mode = get_mode()
+    selected = selector.select(area, mode)
+    return jsonify({
+        "count": len(selected),
+        "area": area.to_dict(),
+        "mode": mode,
+        "data": selector.to_geojson(selected),
+    })
+
+
+@app.route('/quote', methods=['GET', 'POST'])
+def quote():
+    """
+    報價：?land_numbers=a,b,c 或 POST {"land_numbers": [...]}；
+    或範圍（?bbox=、?polygon=、POST {"polygon": <GeoJSON>}），範圍內的地號與田區都列入
+    """
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    body = body if isinstance(body, dict) else {}
+    land_numbers = body.get('land_numbers')
+    if land_numbers is None and request.args.get('land_numbers'):
+        land_numbers = request.args['land_numbers'].split(',')
+    if land_numbers is not None:
+        if not isinstance(land_numbers, list) or len(land_numbers) > MAX_QUOTE:
+            raise InvalidQuery(f"land_numbers must be a list of at most {MAX_QUOTE}")
+        return jsonify(quotes.quote_land_numbers(land_numbers))
+    area = get_area(body.get('polygon'))
+    result = quotes.quote_area(area, get_mode())
+    result["area"] = area.to_dict()
+    return jsonify(result)
+
+
+@app.route('/parcels/stats')
+def stats():
+    return jsonify({**parcels.stats(), **selector.stats(), **quotes.stats()})
+
+
+@app.route('/')
+def index():
+    return '''
+    <h1>地號查詢 API</h1>
+    <ul>
+        <li>/parcels/nearest?lat=24.66&lng=121.785&k=1（最近的 k 筆地號，含距離公尺）</li>
+        <li>/parcels/within?lat=24.66&lng=121.785&radius=50&limit=1000（半徑內的地號，由近到遠）</li>
+        <li>/parcels/select?bbox=min_lon,min_lat,max_lon,max_lat、?polygon=&lt;GeoJSON&gt;，或 POST GeoJSON
+            （&mode=intersects 中心點或邊界與範圍相交，&mode=centroid 只看中心點）</li>
+        <li>/quote?land_numbers=04730000,04740000 或 POST {"land_numbers": [...]}；
+            範圍報價 /quote?bbox=... 或 POST {"polygon": &lt;GeoJSON&gt;}（每分 300 元，1 分 = 293.4 坪）</li>
+        <li>/parcels/stats</li>
+    </ul>
+    '''
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5001, debug=True)
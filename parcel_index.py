@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+地號空間索引（點選地圖時找最近的地號）
+把 baxian_centers.json 這類地號中心點投影到局部公尺座標，放進均勻網格：
+點依 (列, 欄) 排序存成一個連續陣列，同一列相鄰的格子就是陣列中的一段，
+查詢只需對每一列做一次二分搜尋，再算候選點的距離，不用掃過全部地號
+
+用法: python parcel_index.py [--points 300000]   # 微基準測試
+"""
+
+import json
+import math
+import argparse
+
+import numpy as np
+
+from geo import M_PER_DEG_LAT, M_PER_DEG_LON
+
+# 每格平均放幾個點（決定格子大小）
+POINTS_PER_CELL = 4
+# 半徑查詢最多回傳幾筆
+MAX_RESULTS = 1000
+
+
+def load_centers(paths):
+    """讀取一或多個地號中心點檔（[{land_number, lat, lng, ...}, ...]），合併成一個列表"""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        records.extend(r for r in data if r.get("lat") is not None and r.get("lng") is not None)
+    return records
+
+
+class LocalProjection:
+    """以 (lon0, lat0) 為原點的等距圓柱投影（公尺），一個縣的範圍內誤差遠小於地號間距"""
+
+    def __init__(self, lon0, lat0):
+        self.lon0, self.lat0 = lon0, lat0
+        self.kx = M_PER_DEG_LON * math.cos(math.radians(lat0))
+        self.ky = M_PER_DEG_LAT
+
+    def forward(self, coords):
+        """經緯度 (N, 2) -> 公尺 (N, 2)"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack([(coords[:, 0] - self.lon0) * self.kx, (coords[:, 1] - self.lat0) * self.ky])
+
+    def point(self, lon, lat):
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+
+class GridIndex:
+    """
+    平面點 (N, 2) 的均勻網格索引
+    cell_size 未指定時依點的密度決定（每格平均 POINTS_PER_CELL 個點）
+    """
+
+    def __init__(self, xy, cell_size=None):
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if not len(xy):
+            raise ValueError("no points to index")
+        self.origin = xy.min(axis=0)
+        span = np.maximum(xy.max(axis=0) - self.origin, 1.0)
+        if cell_size is None:
+            cell_size = math.sqrt(span[0] * span[1] * POINTS_PER_CELL / len(xy))
+        self.cell_size = max(float(cell_size), 1e-3)
+        self.cols = int(span[0] // self.cell_size) + 1
+        self.rows = int(span[1] // self.cell_size) + 1
+
+        cells = ((xy - self.origin) // self.cell_size).astype(np.int64)
+        keys = cells[:, 1] * self.cols + cells[:, 0]
+        # 依格子排序；同一列的格子在陣列中連續
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.xy = xy[self.order]
+
+    def __len__(self):
+        return len(self.xy)
+
+    def _cell(self, x, y):
+        return (int(math.floor((x - self.origin[0]) / self.cell_size)),
+                int(math.floor((y - self.origin[1]) / self.cell_size)))
+
+    def _candidates(self, cx, cy, reach):
+        """以 (cx, cy) 為中心、往外 reach 格的方塊內所有點（排序後的位置）"""
+        c0, c1 = max(cx - reach, 0), min(cx + reach, self.cols - 1)
+        r0, r1 = max(cy - reach, 0), min(cy + reach, self.rows - 1)
+        if c0 > c1 or r0 > r1:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(r0, r1 + 1) * self.cols
+        starts = np.searchsorted(self.keys, rows + c0, side="left")
+        ends = np.searchsorted(self.keys, rows + c1, side="right")
+        if len(starts) == 1:
+            return np.arange(starts[0], ends[0])
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist()) if e > s]
+                              or [np.empty(0, dtype=np.int64)])
+
+    def _distances(self, pos, x, y):
+        d = self.xy[pos]
+        return np.hypot(d[:, 0] - x, d[:, 1] - y)
+
+    def nearest(self, x, y, k=1):
+        """最近的 k 個點 -> (原始索引, 距離)，依距離排序"""
+        k = min(k, len(self))
+        cx, cy = self._cell(x, y)
+        # 查詢點可能在網格外，先算它到網格的格數距離
+        outside = max(-cx, cx - self.cols + 1, -cy, cy - self.rows + 1, 0)
+        reach = outside + max(1, math.ceil(math.sqrt(k / POINTS_PER_CELL)))
+        limit = outside + max(self.cols, self.rows)
+        while True:
+            pos = self._candidates(cx, cy, reach)
+            if len(pos) >= k or reach >= limit:
+                break
+            reach *= 2
+        d = self._distances(pos, x, y)
+        # 方塊外的點距離至少 reach 格；第 k 近的點比這更遠時，擴大到能涵蓋它的方塊再找一次
+        kth = np.partition(d, k - 1)[k - 1]
+        if kth > reach * self.cell_size and reach < limit:
+            pos = self._candidates(cx, cy, math.ceil(kth / self.cell_size))
+            d = self._distances(pos, x, y)
+        best = np.argpartition(d, k - 1)[:k] if k < len(d) else np.arange(len(d))
+        best = best[np.argsort(d[best], kind="stable")]
+        return self.order[pos[best]], d[best]
+
+    def within(self, x, y, radius):
+        """距離 radius 以內的所有點 -> (原始索引, 距離)，依距離排序"""
+        cx, cy = self._cell(x, y)
+        pos = self._candidates(cx, cy, math.ceil(radius / self.cell_size))
+        d = self._distances(pos, x, y)
+        hit = d <= radius
+        pos, d = pos[hit], d[hit]
+        best = np.argsort(d, kind="stable")
+        return self.order[pos[best]], d[best]
+
+
+class ParcelIndex:
+    """
+    地號中心點的空間索引，records 是可用索引取值的地號資料（dict）序列
+    啟動時建一次；查詢以經緯度輸入，距離單位為公尺
+    """
+
+    def __init__(self, records, coords=None, cell_size=None):
+        self.records = records
+        if coords is None:
+            coords = [(r["lng"], r["lat"]) for r in records]
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        lon0, lat0 = self.coords.mean(axis=0)
+        self.projection = LocalProjection(lon0, lat0)
+        self.grid = GridIndex(self.projection.forward(self.coords), cell_size)
+
+    @classmethod
+    def from_files(cls, paths, cell_size=None):
+        return cls(load_centers(paths), cell_size=cell_size)
+
+    def __len__(self):
+        return len(self.records)
+
+    def nearest(self, lon, lat, k=1):
+        """最近的 k 筆地號 -> (索引陣列, 距離陣列)"""
+        x, y = self.projection.point(lon, lat)
+        return self.grid.nearest(x, y, k)
+
+    def within(self, lon, lat, radius, limit=MAX_RESULTS):
+        """半徑 radius 公尺內的地號（最多 limit 筆，由近到遠）"""
+        x, y = self.projection.point(lon, lat)
+        idx, dist = self.grid.within(x, y, radius)
+        return idx[:limit], dist[:limit]
+
+    def describe(self, indices, distances):
+        """查詢結果轉成可直接輸出 JSON 的列表"""
+        return [dict(self.records[i], distance=round(d, 2))
+                for i, d in zip(indices.tolist(), distances.tolist())]
+
+    def stats(self):
+        return {
+            "parcels": len(self),
+            "cell_size": self.grid.cell_size,
+            "cells": self.grid.rows * self.grid.cols,
+            "occupied_cells": int(len(np.unique(self.grid.keys))),
+        }
+
+
+def _bench():
+    import time
+
+    parser = argparse.ArgumentParser(description="地號空間索引微基準測試")
+    parser.add_argument("--points", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    n = args.points
+    # 約宜蘭縣平地的範圍
+    coords = np.column_stack([rng.uniform(121.60, 121.90, n), rng.uniform(24.45, 24.90, n)])
+    records = [{"land_number": f"{i:08d}"} for i in range(n)]
+
+    t = time.perf_counter()
+    index = ParcelIndex(records, coords)
+    print(f"{n} 筆地號, 建索引 {(time.perf_counter() - t) * 1000:.1f} ms, {index.stats()}")
+
+    queries = np.column_stack([rng.uniform(121.60, 121.90, args.queries),
+                               rng.uniform(24.45, 24.90, args.queries)]).tolist()
+    xy = index.projection.forward(coords)
+    for name, fn in (("nearest k=1", lambda lon, lat: index.nearest(lon, lat, 1)),
+                     ("nearest k=10", lambda lon, lat: index.nearest(lon, lat, 10)),
+                     ("within 100 m", lambda lon, lat: index.within(lon, lat, 100))):
+        t = time.perf_counter()
+        for lon, lat in queries:
+            fn(lon, lat)
+        per = (time.perf_counter() - t) / len(queries)
+        print(f"{name:<14} {per * 1e6:8.1f} µs/次")
+
+    # 與線性掃描比較並驗證結果
+    t = time.perf_counter()
+    for lon, lat in queries[:50]:
+        x, y = index.projection.point(lon, lat)
+        d = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+        idx, dist = index.nearest(lon, lat, 10)
+        assert np.allclose(dist, np.sort(d)[:10])
+        idx, dist = index.within(lon, lat, 100, limit=None)
+        assert len(idx) == np.count_nonzero(d <= 100)
+    per = (time.perf_counter() - t) / 50
+    print(f"線性掃描 + 驗證 {per * 1e6:8.1f} µs/次")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+框選 / 圈選地號
+地號中心點（baxian_centers.json）與田區邊界（baxian_boundaries.json）先配對：
+中心點落在哪個邊界內，那個邊界就是這筆地號的範圍；沒有配到地號的邊界自成一筆。
+選取時先用 R-tree 以外框篩出候選，再精確判斷中心點是否在範圍內、或邊界是否與範圍相交
+
+用法: python parcel_select.py --bbox 121.780,24.658,121.786,24.662
+"""
+
+import json
+import argparse
+
+import numpy as np
+
+from aoi import Area
+from rtree import PackedRTree
+from parcel_index import load_centers
+
+# 選取方式：中心點在範圍內，或中心點/邊界任一與範圍相交
+CENTROID = "centroid"
+INTERSECTS = "intersects"
+MODES = (CENTROID, INTERSECTS)
+
+
+def load_footprints(paths):
+    """讀取一或多個邊界 GeoJSON，回傳 [(外環 (N, 2) 陣列, properties), ...]"""
+    footprints = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") != "Polygon":
+                continue
+            ring = np.asarray(geometry["coordinates"][0], dtype=np.float64).reshape(-1, 2)
+            if len(ring) >= 3:
+                footprints.append((ring, feature.get("properties") or {}))
+    return footprints
+
+
+def _segments_cross(a, b):
+    """環 a 與環 b 的邊是否相交（含端點接觸）；a, b 為 (N, 2) 陣列，視為封閉"""
+    a0, a1 = a, np.roll(a, -1, axis=0)
+    b0, b1 = b, np.roll(b, -1, axis=0)
+
+    def orient(p, q, r):
+        # p, q: (M, 1, 2) 或 (1, N, 2)；r 同
+        return (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+
+    p0, p1 = a0[:, None, :], a1[:, None, :]
+    q0, q1 = b0[None, :, :], b1[None, :, :]
+    d1, d2 = orient(q0, q1, p0), orient(q0, q1, p1)
+    d3, d4 = orient(p0, p1, q0), orient(p0, p1, q1)
+    # 共線時方向判斷全為 0，再用外框排除不重疊的線段
+    boxes = ((np.minimum(p0[..., 0], p1[..., 0]) <= np.maximum(q0[..., 0], q1[..., 0]))
+             & (np.minimum(q0[..., 0], q1[..., 0]) <= np.maximum(p0[..., 0], p1[..., 0]))
+             & (np.minimum(p0[..., 1], p1[..., 1]) <= np.maximum(q0[..., 1], q1[..., 1]))
+             & (np.minimum(q0[..., 1], q1[..., 1]) <= np.maximum(p0[..., 1], p1[..., 1])))
+    return bool(np.any((d1 * d2 <= 0) & (d3 * d4 <= 0) & boxes))
+
+
+class Footprints:
+    """
+    所有邊界：串接的座標陣列 ring_coords (M, 2)、每個環的起點 ring_offsets（環數 + 1），
+    以及可用索引取值的 properties 序列
+    """
+
+    def __init__(self, ring_coords, ring_offsets, props):
+        self.ring_coords = ring_coords
+        self.ring_offsets = ring_offsets
+        self.props = props
+
+    @classmethod
+    def from_list(cls, footprints):
+        """[(外環, properties), ...]"""
+        rings = [ring for ring, _ in footprints]
+        lengths = np.array([len(r) for r in rings], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        coords = np.vstack(rings) if rings else np.empty((0, 2))
+        return cls(coords, offsets, [props for _, props in footprints])
+
+    def __len__(self):
+        return len(self.ring_offsets) - 1
+
+    def ring(self, j):
+        return self.ring_coords[self.ring_offsets[j]:self.ring_offsets[j + 1]]
+
+    def boxes(self):
+        """每個環的外框 (環數, 4)"""
+        if not len(self):
+            return np.empty((0, 4))
+        xy = self.ring_coords
+        starts = self.ring_offsets[:-1]
+        return np.column_stack([
+            np.minimum.reduceat(xy[:, 0], starts),
+            np.minimum.reduceat(xy[:, 1], starts),
+            np.maximum.reduceat(xy[:, 0], starts),
+            np.maximum.reduceat(xy[:, 1], starts),
+        ])
+
+    def centroids(self, indices):
+        """環頂點（不含封閉點）的平均 (len(indices), 2)"""
+        return np.array([self.ring(j)[:-1].mean(axis=0) for j in indices]).reshape(-1, 2)
+
+
+class ParcelSelector:
+    """
+    records: 地號資料序列（與 coords 一一對應）；coords: 地號中心點 (N, 2) 經緯度
+    footprints: [(外環, properties), ...] 或 Footprints
+    parcel_ring: 已知的地號 -> 邊界配對（-1 表示沒有），例如從 parcel_store 讀出；沒有時在這裡配對
+    """
+
+    def __init__(self, records, coords=None, footprints=(), parcel_ring=None):
+        self.records = records
+        if coords is None:
+            coords = [(r["lng"], r["lat"]) for r in records]
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+
+        if not isinstance(footprints, Footprints):
+            footprints = Footprints.from_list(footprints)
+        self.footprints = footprints
+        self.ring_coords = footprints.ring_coords
+        self.ring_offsets = footprints.ring_offsets
+        self.footprint_props = footprints.props
+        ring_boxes = footprints.boxes()
+
+        if parcel_ring is None:
+            # 中心點配對邊界：以邊界外框查點的 R-tree，再做點在多邊形內
+            parcel_ring = np.full(len(coords), -1, dtype=np.int64)
+            points = PackedRTree(np.hstack([coords, coords]))
+            for j in range(len(footprints)):
+                cand = points.search(*ring_boxes[j])
+                cand = cand[parcel_ring[cand] < 0]
+                if len(cand):
+                    ring = footprints.ring(j)
+                    parcel_ring[cand[Area([[ring]]).contains(coords[cand])]] = j
+        parcel_ring = np.asarray(parcel_ring, dtype=np.int64)
+        matched = np.zeros(len(footprints), dtype=bool)
+        matched[parcel_ring[parcel_ring >= 0]] = True
+
+        # 選取的單位：每筆地號，加上沒有配到地號的邊界
+        loose = np.nonzero(~matched)[0]
+        self.centroids = np.vstack([coords, footprints.centroids(loose)])
+        self.ring = np.concatenate([parcel_ring, loose])
+        self.record = np.concatenate([np.arange(len(coords)), np.full(len(loose), -1)])
+
+        boxes = np.hstack([self.centroids, self.centroids])
+        has_ring = self.ring >= 0
+        boxes[has_ring] = ring_boxes[self.ring[has_ring]]
+        self.tree = PackedRTree(boxes)
+
+    @classmethod
+    def from_files(cls, center_paths, footprint_paths=()):
+        return cls(load_centers(center_paths), footprints=load_footprints(footprint_paths))
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def ring_at(self, j):
+        return self.footprints.ring(j)
+
+    def _rings_touch(self, rings, area):
+        """邊界 rings（索引陣列）各自是否與範圍相交"""
+        # 1. 邊界有頂點在範圍內（一次判斷所有頂點）
+        starts = self.ring_offsets[rings]
+        lengths = self.ring_offsets[rings + 1] - starts
+        first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        vertex = np.repeat(starts - first, lengths) + np.arange(lengths.sum())
+        touch = np.logical_or.reduceat(area.contains(self.ring_coords[vertex]), first)
+        # 2. 剩下的：範圍整個在邊界內（範圍的頂點在邊界內），或兩者的邊相交
+        area_rings = [r for polygon in area.polygons for r in polygon]
+        area_vertices = np.vstack([polygon[0][:1] for polygon in area.polygons])
+        for i in np.nonzero(~touch)[0]:
+            ring = self.ring_at(rings[i])
+            if Area([[ring]]).contains(area_vertices).any() or any(_segments_cross(ring, r) for r in area_rings):
+                touch[i] = True
+        return touch
+
+    def select(self, area, mode=INTERSECTS):
+        """範圍內的選取單位索引；area 為 aoi.Area"""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        cand = self.tree.search(*area.bounds)
+        if not len(cand):
+            return cand
+        hit = area.contains(self.centroids[cand])
+        if mode == INTERSECTS:
+            rest = np.nonzero(~hit & (self.ring[cand] >= 0))[0]
+            if len(rest):
+                hit[rest] = self._rings_touch(self.ring[cand[rest]], area)
+        return cand[hit]
+
+    def feature(self, i):
+        """選取單位轉成 GeoJSON feature：有邊界時是 Polygon，否則是中心點"""
+        r, j = int(self.record[i]), int(self.ring[i])
+        properties = dict(self.records[r]) if r >= 0 else {"land_number": None}
+        if j >= 0:
+            properties["footprint"] = self.footprint_props[j]
+            geometry = {"type": "Polygon", "coordinates": [self.ring_at(j).tolist()]}
+        else:
+            geometry = {"type": "Point", "coordinates": self.centroids[i].tolist()}
+        return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+    def to_geojson(self, indices):
+        return {"type": "FeatureCollection", "features": [self.feature(i) for i in indices.tolist()]}
+
+    def stats(self):
+        parcels = int(np.count_nonzero(self.record >= 0))
+        return {
+            "parcels": parcels,
+            "footprints": len(self.footprint_props),
+            "parcels_with_footprint": int(np.count_nonzero(self.ring[:parcels] >= 0)),
+            "footprints_without_parcel": len(self) - parcels,
+        }
+
+
+def main():
+    import time
+
+    parser = argparse.ArgumentParser(description="框選 / 圈選地號")
+    parser.add_argument("--centers", nargs="+", default=["baxian_centers.json"])
+    parser.add_argument("--boundaries", nargs="*", default=["baxian_boundaries.json"])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--bbox", help="min_lon,min_lat,max_lon,max_lat")
+    group.add_argument("--polygon", help="GeoJSON 檔（Polygon / MultiPolygon / Feature / FeatureCollection）")
+    parser.add_argument("--mode", choices=MODES, default=INTERSECTS)
+    parser.add_argument("--output", help="輸出選取結果 GeoJSON")
+    args = parser.parse_args()
+
+    selector = ParcelSelector.from_files(args.centers, args.boundaries)
+    print(selector.stats())
+    if args.bbox:
+        area = Area.parse_bbox(args.bbox)
+    else:
+        with open(args.polygon, encoding="utf-8") as f:
+            area = Area.from_geojson(json.load(f))
+
+    t = time.perf_counter()
+    selected = selector.select(area, args.mode)
+    print(f"選到 {len(selected)} 筆，{(time.perf_counter() - t) * 1000:.2f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(selector.to_geojson(selected), f, ensure_ascii=False, separators=(",", ":"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+地號二進位欄式儲存
+取代 baxian_centers.json / baxian_boundaries.json 這類要整個解析才能查詢的大 JSON：
+一個目錄，每個欄位一個 .npy（可 memory-map），邊界是一個連續座標陣列加上每個環的起點，
+不固定的 properties 則是 JSON 片段串接成的位元組陣列加上起點，用到哪一筆才解碼哪一筆
+
+    meta.json                      格式版本、筆數
+    land_number.npy                地號（UTF-8, 定長 bytes）
+    land_number_order.npy          依地號排序的索引（二分搜尋用）
+    lng.npy / lat.npy              中心點
+    area.npy                       面積（坪，nan 表示沒有）
+    unit_price.npy                 單價（萬/坪，nan 表示沒有）
+    price.npy / land_type.npy      總價（nan 表示沒有）/ 土地類型（-1 表示沒有）
+    footprint.npy                  地號所在的邊界（-1 表示沒有）
+    extra.npy / extra_offsets.npy  其他欄位（JSON）
+    ring_coords.npy / ring_offsets.npy                    邊界外環
+    footprint_props.npy / footprint_props_offsets.npy     邊界的 properties（JSON）
+
+用法: python parcel_store.py build baxian.parcels baxian_centers.json baxian_boundaries.json
+      python parcel_store.py export baxian.parcels --centers centers.json --boundaries boundaries.json
+      python parcel_store.py info baxian.parcels
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from land_area import parse_area
+from parcel_select import ParcelSelector, Footprints, load_footprints
+
+FORMAT = "parcel-store"
+VERSION = 1
+META = "meta.json"
+
+# 地號資料中以欄位儲存的 key，其餘放進 extra
+COLUMNS = ("land_number", "lat", "lng", "area", "unit_price", "price", "land_type")
+_PRICE_RE = re.compile(r"^\s*([0-9][0-9,]*(?:\.[0-9]+)?)\s*(萬|元)/坪\s*$")
+
+
+def parse_unit_price(value):
+    """單價 {"value": 1.19, "unit": "萬/坪"}、"1.29萬/坪" 或 "9586.78元/坪" 換算成 萬/坪；沒有時回傳 nan"""
+    if value is None:
+        return math.nan
+    if isinstance(value, dict):
+        if value.get("value") is None:
+            return math.nan
+        return float(value["value"]) / (10000 if value.get("unit") == "元/坪" else 1)
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _PRICE_RE.match(str(value))
+    if not m:
+        return math.nan
+    return float(m.group(1).replace(",", "")) / (10000 if m.group(2) == "元" else 1)
+
+
+def _float(value):
+    return math.nan if value is None else float(value)
+
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else value
+
+
+def _encode_blobs(items):
+    """dict 列表 -> (位元組陣列, 起點)；空 dict 存成空字串"""
+    chunks = [json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if d else b""
+              for d in items]
+    offsets = np.concatenate([[0], np.cumsum([len(c) for c in chunks])]).astype(np.int64)
+    return np.frombuffer(b"".join(chunks), dtype=np.uint8), offsets
+
+
+class BlobSequence:
+    """JSON 片段的序列，取值時才解碼"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self.blob[start:end].tobytes()) if end > start else {}
+
+
+class StoreRecords:
+    """ParcelStore 的地號資料序列，取值時從欄位組回與 baxian_centers.json 相同格式的 dict"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        return self.store.record(i)
+
+    def __iter__(self):
+        return (self.store.record(i) for i in range(len(self.store)))
+
+    def column(self, name):
+        """整個欄位（給需要一次處理所有地號的地方用）"""
+        if name == "land_number":
+            return self.store.land_numbers()
+        return getattr(self.store, name)
+
+
+def write_store(path, records, footprints=(), parcel_ring=None):
+    """
+    records: [{land_number, lat, lng, area, unit_price, ...}, ...]；footprints: [(外環, properties), ...]
+    parcel_ring 未指定時依中心點落在哪個邊界內配對；先寫到暫存目錄再換名。
+    path 已存在時只會取代既有的地號儲存，其他檔案或目錄一律不動
+    """
+    if os.path.lexists(path) and not is_store(path):
+        raise FileExistsError(f"{path} exists and is not a {FORMAT} directory")
+    if parcel_ring is None:
+        selector = ParcelSelector(records, footprints=footprints)
+        parcel_ring = selector.ring[:len(records)]
+    fp = footprints if isinstance(footprints, Footprints) else Footprints.from_list(footprints)
+
+    numbers = np.array([str(r.get("land_number") or "").encode("utf-8") for r in records], dtype=bytes)
+    if not len(numbers):
+        numbers = np.empty(0, dtype="S1")
+    columns = {
+        "land_number": numbers,
+        "land_number_order": np.argsort(numbers, kind="stable").astype(np.int64),
+        "lng": np.array([r["lng"] for r in records], dtype=np.float64),
+        "lat": np.array([r["lat"] for r in records], dtype=np.float64),
+        "area": np.array([parse_area(r.get("area")) for r in records], dtype=np.float64),
+        "unit_price": np.array([parse_unit_price(r.get("unit_price")) for r in records], dtype=np.float64),
+        "price": np.array([_float(r.get("price")) for r in records], dtype=np.float64),
+        "land_type": np.array([-1 if r.get("land_type") is None else r["land_type"] for r in records],
+                              dtype=np.int32),
+        "footprint": np.asarray(parcel_ring, dtype=np.int64),
+        "ring_coords": np.asarray(fp.ring_coords, dtype=np.float64).reshape(-1, 2),
+        "ring_offsets": np.asarray(fp.ring_offsets, dtype=np.int64),
+    }
+    columns["extra"], columns["extra_offsets"] = _encode_blobs(
+        [{k: v for k, v in r.items() if k not in COLUMNS} for r in records])
+    columns["footprint_props"], columns["footprint_props_offsets"] = _encode_blobs(
+        [fp.props[j] for j in range(len(fp))])
+
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp = tempfile.mkdtemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp", dir=parent)
+    try:
+        os.chmod(tmp, 0o755)
+        for name, array in columns.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array, allow_pickle=False)
+        with open(os.path.join(tmp, META), "w", encoding="utf-8") as f:
+            json.dump({"format": FORMAT, "version": VERSION, "parcels": len(records), "footprints": len(fp)}, f)
+        # 舊的儲存先換名移開，新的換上後才刪；正在 memory-map 舊檔的程序不受影響
+        old = None
+        if os.path.lexists(path):
+            old = f"{tmp[:-len('.tmp')]}.old"
+            os.replace(path, old)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def is_store(path):
+    """path 是否為地號儲存目錄（有 format 相符的 meta.json）"""
+    try:
+        with open(os.path.join(path, META), encoding="utf-8") as f:
+            return json.load(f).get("format") == FORMAT
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+class ParcelStore:
+    """以 memory-map 開啟的地號儲存；開啟時只讀 meta.json 與 .npy 標頭，資料在用到時才從檔案讀入"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT or self.meta.get("version") != VERSION:
+            raise ValueError(f"{path} is not a {FORMAT} v{VERSION} directory")
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+
+        self.land_number = load("land_number")
+        self.land_number_order = load("land_number_order")
+        self.lng = load("lng")
+        self.lat = load("lat")
+        self.area = load("area")
+        self.unit_price = load("unit_price")
+        self.price = load("price")
+        self.land_type = load("land_type")
+        self.footprint = load("footprint")
+        self.extra = BlobSequence(load("extra"), load("extra_offsets"))
+        self.footprints = Footprints(load("ring_coords"), load("ring_offsets"),
+                                     BlobSequence(load("footprint_props"), load("footprint_props_offsets")))
+        self.records = StoreRecords(self)
+
+    def __len__(self):
+        return len(self.lng)
+
+    def coords(self):
+        """中心點 (N, 2) 經緯度"""
+        return np.column_stack([self.lng, self.lat])
+
+    def land_numbers(self):
+        """所有地號（str 的 object 陣列）"""
+        return np.char.decode(np.asarray(self.land_number), "utf-8").astype(object)
+
+    def record(self, i):
+        """第 i 筆地號，格式與 baxian_centers.json 相同（面積以坪的數字表示）"""
+        unit_price = float(self.unit_price[i])
+        land_type = int(self.land_type[i])
+        return {
+            "land_number": self.land_number[i].decode("utf-8"),
+            "lat": float(self.lat[i]),
+            "lng": float(self.lng[i]),
+            "area": _nan_to_none(float(self.area[i])),
+            "unit_price": None if math.isnan(unit_price) else {"value": unit_price, "unit": "萬/坪"},
+            "land_type": None if land_type < 0 else land_type,
+            "price": _nan_to_none(float(self.price[i])),
+            **self.extra[i],
+        }
+
+    def find(self, land_number):
+        """地號的所有索引；在排序索引上二分搜尋，只讀取搜尋路徑上的幾筆"""
+        key = str(land_number).encode("utf-8")
+        order, numbers = self.land_number_order, self.land_number
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if numbers[order[mid]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < len(order) and numbers[order[lo]] == key:
+            found.append(int(order[lo]))
+            lo += 1
+        return found
+
+    def selector(self):
+        """直接以欄位建立 ParcelSelector（地號與邊界的配對已存在檔案中）"""
+        return ParcelSelector(self.records, self.coords(), self.footprints, np.asarray(self.footprint))
+
+
+# ---- GeoJSON 轉換 ----
+
+def read_inputs(paths):
+    """
+    地號中心點檔（baxian_centers.json 格式的列表）或 GeoJSON FeatureCollection：
+    Point feature 視為地號（properties + 座標），Polygon feature 視為邊界
+    """
+    records, footprints = [], []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            records.extend(r for r in data if r.get("lat") is not None and r.get("lng") is not None)
+            continue
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            props = dict(feature.get("properties") or {})
+            if geometry.get("type") == "Point":
+                lng, lat = geometry["coordinates"][:2]
+                records.append({**props, "lng": lng, "lat": lat})
+        footprints.extend(load_footprints([path]))
+    return records, footprints
+
+
+def centers_to_geojson(store):
+    """地號 -> Point FeatureCollection（properties 不含 lat/lng）"""
+    features = []
+    for i in range(len(store)):
+        props = store.record(i)
+        lng, lat = props.pop("lng"), props.pop("lat")
+        features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                         "properties": props})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def footprints_to_geojson(store):
+    """邊界 -> Polygon FeatureCollection"""
+    fp = store.footprints
+    coords = np.asarray(fp.ring_coords)
+    offsets = np.asarray(fp.ring_offsets).tolist()
+    return {"type": "FeatureCollection", "features": [
+        {"type": "Feature",
+         "geometry": {"type": "Polygon", "coordinates": [coords[offsets[j]:offsets[j + 1]].tolist()]},
+         "properties": fp.props[j]}
+        for j in range(len(fp))
+    ]}
+
+
+def _dump(obj, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    import time
+
+    parser = argparse.ArgumentParser(description="地號二進位欄式儲存")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="JSON / GeoJSON -> 儲存目錄")
+    build.add_argument("store")
+    build.add_argument("inputs", nargs="+", help="地號中心點 JSON 或 GeoJSON（Point 為地號、Polygon 為邊界）")
+    export = sub.add_parser("export", help="儲存目錄 -> JSON / GeoJSON")
+    export.add_argument("store")
+    export.add_argument("--centers", help="輸出 baxian_centers.json 格式的地號列表")
+    export.add_argument("--points", help="輸出地號的 Point GeoJSON")
+    export.add_argument("--boundaries", help="輸出邊界的 Polygon GeoJSON")
+    info = sub.add_parser("info", help="顯示內容摘要")
+    info.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        records, footprints = read_inputs(args.inputs)
+        write_store(args.store, records, footprints)
+        before = sum(os.path.getsize(p) for p in args.inputs)
+        print(f"{len(records)} 筆地號、{len(footprints)} 個邊界: "
+              f"{before / 1024:.1f} KB -> {_size(args.store) / 1024:.1f} KB")
+    elif args.command == "export":
+        store = ParcelStore(args.store)
+        if args.centers:
+            _dump(list(store.records), args.centers)
+        if args.points:
+            _dump(centers_to_geojson(store), args.points)
+        if args.boundaries:
+            _dump(footprints_to_geojson(store), args.boundaries)
+    else:
+        t = time.perf_counter()
+        store = ParcelStore(args.store)
+        opened = time.perf_counter() - t
+        print(f"{args.store}: {store.meta['parcels']} 筆地號、{store.meta['footprints']} 個邊界、"
+              f"{_size(args.store) / 1024:.1f} KB，開啟 {opened * 1000:.2f} ms")
+        if len(store):
+            print(store.record(0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+邊界多邊形簡化與座標量化
+CHAIN_APPROX_SIMPLE 的輪廓保留了每個像素階梯，座標又寫到 15 位小數；
+這裡在局部公尺座標上做 Douglas-Peucker 或 Visvalingam 簡化，
+簡化後會自我相交或塌成線的環改用較小的容許誤差重試（保持拓樸有效），
+最後把經緯度量化到 1e-7 度（約 1 公分）
+"""
+
+import math
+import heapq
+
+import numpy as np
+
+from geo import M_PER_DEG_LAT, M_PER_DEG_LON
+
+DEFAULT_TOLERANCE_M = 0.5
+DEFAULT_PRECISION = 7
+RETRIES = 4
+
+
+def to_local_meters(ring):
+    """經緯度 (N, 2) 轉以第一點為原點的局部公尺座標"""
+    ring = np.asarray(ring, dtype=np.float64)
+    lon0, lat0 = ring[0]
+    x = (ring[:, 0] - lon0) * M_PER_DEG_LON * math.cos(math.radians(lat0))
+    y = (ring[:, 1] - lat0) * M_PER_DEG_LAT
+    return np.column_stack([x, y])
+
+
+def _dp_keep(xy, tolerance):
+    """Douglas-Peucker（開放折線），回傳保留點的 mask"""
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        a, b = xy[i], xy[j]
+        pts = xy[i + 1:j]
+        ab = b - a
+        length = math.hypot(ab[0], ab[1])
+        if length == 0:
+            d = np.hypot(pts[:, 0] - a[0], pts[:, 1] - a[1])
+        else:
+            d = np.abs(ab[0] * (pts[:, 1] - a[1]) - ab[1] * (pts[:, 0] - a[0])) / length
+        k = int(np.argmax(d))
+        if d[k] > tolerance:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return keep
+
+
+def douglas_peucker(xy, tolerance):
+    """閉合環的 Douglas-Peucker：從離起點最遠的點切成兩段分別簡化"""
+    ring = xy[:-1]
+    far = int(np.argmax(np.hypot(ring[:, 0] - ring[0, 0], ring[:, 1] - ring[0, 1])))
+    if far == 0:
+        return np.ones(len(xy), dtype=bool)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[:far + 1] = _dp_keep(xy[:far + 1], tolerance)
+    keep[far:] |= _dp_keep(xy[far:], tolerance)
+    return keep
+
+
+def visvalingam(xy, tolerance):
+    """Visvalingam-Whyatt：移除有效面積小於 tolerance^2 的點（閉合環）"""
+    ring = xy[:-1]
+    n = len(ring)
+    keep = np.ones(len(xy), dtype=bool)
+    if n <= 3:
+        return keep
+
+    prev = [(i - 1) % n for i in range(n)]
+    nxt = [(i + 1) % n for i in range(n)]
+    removed = [False] * n
+
+    def area(i):
+        a, b, c = ring[prev[i]], ring[i], ring[nxt[i]]
+        return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) / 2.0
+
+    threshold = tolerance * tolerance
+    heap = [(area(i), i) for i in range(1, n)]
+    heapq.heapify(heap)
+    current = {i: a for a, i in heap}
+    remaining = n
+
+    while heap and remaining > 3:
+        a, i = heapq.heappop(heap)
+        if removed[i] or current.get(i) != a:
+            continue
+        if a >= threshold:
+            break
+        removed[i] = True
+        remaining -= 1
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        # 起點固定保留，確保環仍然閉合在同一點
+        for j in (p, q):
+            if j != 0 and not removed[j]:
+                current[j] = area(j)
+                heapq.heappush(heap, (current[j], j))
+
+    keep[:-1] = ~np.array(removed)
+    return keep
+
+
+def self_intersects(xy):
+    """閉合環是否自我相交（非相鄰邊兩兩檢查）"""
+    n = len(xy) - 1
+    if n < 4:
+        return False
+    a = xy[:-1]
+    b = xy[1:]
+
+    def orient(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1])
+                       - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+    i, j = np.triu_indices(n, k=2)
+    # 第一條與最後一條邊相鄰
+    mask = ~((i == 0) & (j == n - 1))
+    i, j = i[mask], j[mask]
+    o1 = orient(a[i], b[i], a[j])
+    o2 = orient(a[i], b[i], b[j])
+    o3 = orient(a[j], b[j], a[i])
+    o4 = orient(a[j], b[j], b[i])
+    return bool(np.any((o1 * o2 < 0) & (o3 * o4 < 0)))
+
+
+METHODS = {
+    "dp": douglas_peucker,
+    "vw": visvalingam,
+}
+
+
+def simplify_ring(ring, tolerance=DEFAULT_TOLERANCE_M, method="dp"):
+    """簡化單一閉合環（經緯度），tolerance 單位為公尺"""
+    ring = np.asarray(ring, dtype=np.float64)
+    if tolerance <= 0 or len(ring) <= 4:
+        return ring
+    xy = to_local_meters(ring)
+    simplify = METHODS[method]
+
+    tol = tolerance
+    for _ in range(RETRIES + 1):
+        keep = simplify(xy, tol)
+        if keep.sum() >= 4 and not self_intersects(xy[keep]):
+            return ring[keep]
+        tol /= 2
+    return ring
+
+
+def quantize_ring(ring, precision=DEFAULT_PRECISION):
+    """座標四捨五入到 precision 位小數，並去掉因此重複的連續點"""
+    ring = np.round(np.asarray(ring, dtype=np.float64), precision)
+    if len(ring) > 1:
+        dup = np.all(ring[1:] == ring[:-1], axis=1)
+        ring = np.vstack([ring[:1], ring[1:][~dup]])
+    return ring
+
+
+def simplify_features(features, tolerance=DEFAULT_TOLERANCE_M, method="dp", precision=DEFAULT_PRECISION):
+    """
+    簡化 + 量化所有 Polygon feature（原地修改 geometry）
+    回傳 {"vertices_before": ..., "vertices_after": ...}
+    """
+    before = after = 0
+    for f in features:
+        geom = f["geometry"]
+        if geom["type"] != "Polygon":
+            continue
+        rings = []
+        for ring in geom["coordinates"]:
+            before += len(ring)
+            ring = simplify_ring(ring, tolerance, method)
+            if precision is not None:
+                quantized = quantize_ring(ring, precision)
+                # 量化後塌掉的小環保留原座標
+                ring = quantized if len(quantized) >= 4 else ring
+            after += len(ring)
+            rings.append(ring)
+        geom["coordinates"] = rings
+    return {"vertices_before": before, "vertices_after": after}
+
+
+def print_report(stats, bytes_before, bytes_after):
+    """簡化前後的頂點數與檔案大小"""
+    vb, va = stats["vertices_before"], stats["vertices_after"]
+    print(f"頂點: {vb} -> {va}（減少 {100 * (1 - va / vb) if vb else 0:.1f}%）")
+    print(f"大小: {bytes_before / 1024:.1f} KB -> {bytes_after / 1024:.1f} KB"
+          f"（減少 {100 * (1 - bytes_after / bytes_before) if bytes_before else 0:.1f}%）")
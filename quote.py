@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+噴灑報價
+每分 300 元（1 分 = 293.4 坪）。面積優先用地號資料裡 591 的 area 欄位（例如 "399.61坪"），
+沒有時用田區邊界的橢球面積；所有選取單位的面積在啟動時算好，報價只是陣列運算
+
+用法: python quote.py --land-numbers 04730000,04740000
+      python quote.py --bbox 121.780,24.658,121.786,24.662
+"""
+
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from aoi import Area
+from land_area import parse_areas, ring_areas_m2, m2_to_ping, ping_to_fen, PING_PER_FEN
+from parcel_select import ParcelSelector, INTERSECTS
+
+PRICE_PER_FEN = float(os.environ.get("QUOTE_PRICE_PER_FEN", 300))
+
+# 面積來源
+SOURCE_NONE = 0
+SOURCE_LISTING = 1
+SOURCE_FOOTPRINT = 2
+SOURCE_NAMES = np.array([None, "listing", "footprint"], dtype=object)
+
+
+class QuoteEngine:
+    """以 ParcelSelector 的選取單位（地號，或沒有配到地號的田區邊界）為報價對象"""
+
+    def __init__(self, selector, price_per_fen=PRICE_PER_FEN):
+        self.selector = selector
+        self.price_per_fen = price_per_fen
+        n = len(selector)
+        record = selector.record
+        has_record = record >= 0
+
+        records = selector.records
+        listing = np.full(n, np.nan)
+        if hasattr(records, "column"):
+            # parcel_store 的地號：面積欄位已是坪
+            listing[has_record] = records.column("area")[record[has_record]]
+            numbers = records.column("land_number")
+        else:
+            listing[has_record] = parse_areas([records[r].get("area") for r in record[has_record].tolist()])
+            numbers = [r.get("land_number") for r in records]
+        footprint = np.full(n, np.nan)
+        ring_ping = m2_to_ping(ring_areas_m2(selector.ring_coords, selector.ring_offsets))
+        has_ring = selector.ring >= 0
+        footprint[has_ring] = ring_ping[selector.ring[has_ring]]
+
+        use_listing = np.isfinite(listing)
+        use_footprint = ~use_listing & np.isfinite(footprint)
+        self.area_ping = np.where(use_listing, listing, footprint)
+        self.source = np.where(use_listing, SOURCE_LISTING, np.where(use_footprint, SOURCE_FOOTPRINT, SOURCE_NONE))
+
+        self.land_numbers = np.array([numbers[r] if r >= 0 else None for r in record.tolist()], dtype=object)
+        # 地號 -> 選取單位（同一地號重複出現時取第一筆）
+        self.by_land_number = {}
+        for i, number in enumerate(self.land_numbers.tolist()):
+            if number is not None:
+                self.by_land_number.setdefault(number, i)
+
+    def lookup(self, land_numbers):
+        """地號列表 -> (選取單位索引陣列, 找不到的地號)；重複的地號只算一次"""
+        units, unknown, seen = [], [], set()
+        for number in land_numbers:
+            number = str(number).strip()
+            if not number or number in seen:
+                continue
+            seen.add(number)
+            i = self.by_land_number.get(number)
+            if i is None:
+                unknown.append(number)
+            else:
+                units.append(i)
+        return np.array(units, dtype=np.int64), unknown
+
+    def quote(self, units, unknown=()):
+        """選取單位的逐筆與合計費用；費用取整數元，合計是逐筆加總"""
+        units = np.asarray(units, dtype=np.int64)
+        ping = self.area_ping[units]
+        known = np.isfinite(ping)
+        fen = ping_to_fen(ping)
+        cost = np.where(known, np.round(fen * self.price_per_fen), np.nan)
+
+        items = [
+            {
+                "land_number": number,
+                "area_ping": round(p, 2) if k else None,
+                "area_fen": round(f, 4) if k else None,
+                "area_source": source,
+                "cost": int(c) if k else None,
+            }
+            for number, p, f, c, k, source in zip(
+                self.land_numbers[units].tolist(), ping.tolist(), fen.tolist(), cost.tolist(),
+                known.tolist(), SOURCE_NAMES[self.source[units]].tolist())
+        ]
+        return {
+            "price_per_fen": self.price_per_fen,
+            "ping_per_fen": PING_PER_FEN,
+            "items": items,
+            "total": {
+                "parcels": int(known.sum()),
+                "area_ping": round(float(ping[known].sum()), 2),
+                "area_fen": round(float(fen[known].sum()), 4),
+                "cost": int(cost[known].sum()),
+            },
+            # 沒有面積（既沒有 591 面積也沒有邊界）的地號，無法報價
+            "missing_area": [number for number, k in zip(self.land_numbers[units].tolist(), known.tolist()) if not k],
+            "unknown": list(unknown),
+        }
+
+    def quote_land_numbers(self, land_numbers):
+        units, unknown = self.lookup(land_numbers)
+        return self.quote(units, unknown)
+
+    def quote_area(self, area, mode=INTERSECTS):
+        return self.quote(self.selector.select(area, mode))
+
+    def stats(self):
+        return {
+            "units": len(self.area_ping),
+            "area_from_listing": int(np.count_nonzero(self.source == SOURCE_LISTING)),
+            "area_from_footprint": int(np.count_nonzero(self.source == SOURCE_FOOTPRINT)),
+            "area_missing": int(np.count_nonzero(self.source == SOURCE_NONE)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="噴灑報價")
+    parser.add_argument("--centers", nargs="+", default=["baxian_centers.json"])
+    parser.add_argument("--boundaries", nargs="*", default=["baxian_boundaries.json"])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--land-numbers", help="逗號分隔的地號")
+    group.add_argument("--bbox", help="min_lon,min_lat,max_lon,max_lat")
+    group.add_argument("--polygon", help="GeoJSON 檔（Polygon / MultiPolygon / Feature / FeatureCollection）")
+    parser.add_argument("--price", type=float, default=PRICE_PER_FEN, help="每分價格")
+    args = parser.parse_args()
+
+    engine = QuoteEngine(ParcelSelector.from_files(args.centers, args.boundaries), args.price)
+    print(engine.stats())
+    t = time.perf_counter()
+    if args.land_numbers:
+        result = engine.quote_land_numbers(args.land_numbers.split(","))
+    elif args.bbox:
+        result = engine.quote_area(Area.parse_bbox(args.bbox))
+    else:
+        with open(args.polygon, encoding="utf-8") as f:
+            result = engine.quote_area(Area.from_geojson(json.load(f)))
+    elapsed = time.perf_counter() - t
+
+    for item in result["items"]:
+        print(f"{item['land_number'] or '(未配對邊界)':<14} {item['area_ping'] or '-':>10} 坪 "
+              f"{item['area_fen'] or '-':>8} 分 {item['cost'] if item['cost'] is not None else '-':>8} 元 "
+              f"{item['area_source'] or ''}")
+    total = result["total"]
+    print(f"合計 {total['parcels']} 筆 {total['area_ping']} 坪 / {total['area_fen']} 分 = {total['cost']} 元"
+          f"（{elapsed * 1000:.2f} ms）")
+    if result["missing_area"]:
+        print(f"沒有面積: {len(result['missing_area'])} 筆")
+    if result["unknown"]:
+        print(f"找不到的地號: {', '.join(result['unknown'])}")
+
+
+if __name__ == "__main__":
+    main()
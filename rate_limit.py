@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Token bucket 限速器（執行緒安全）
+"""
+
+import time
+import threading
+
+
+class TokenBucket:
+    """每秒補充 rate 個 token，最多累積 burst 個"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取得 token，不夠就等待；rate <= 0 表示不限速"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
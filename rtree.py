@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+靜態 R-tree（STR 打包）
+一次建好、只查詢不修改：外框依 Sort-Tile-Recursive 排序後每 node_size 個打包成一個節點，
+每一層的節點外框都是一個 numpy 陣列，查詢時逐層把與查詢框相交的節點展開成子節點
+"""
+
+import math
+
+import numpy as np
+
+NODE_SIZE = 16
+
+
+def _union(boxes, node_size):
+    """每 node_size 個連續外框合併成一個（最後一組可能不滿）"""
+    n = len(boxes)
+    starts = np.arange(0, n, node_size)
+    return np.column_stack([
+        np.minimum.reduceat(boxes[:, 0], starts),
+        np.minimum.reduceat(boxes[:, 1], starts),
+        np.maximum.reduceat(boxes[:, 2], starts),
+        np.maximum.reduceat(boxes[:, 3], starts),
+    ])
+
+
+class PackedRTree:
+    """boxes: (N, 4) 的 (min_x, min_y, max_x, max_y)；點可用 min == max 的外框"""
+
+    def __init__(self, boxes, node_size=NODE_SIZE):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.node_size = node_size
+        n = len(boxes)
+        if n:
+            # STR：先依中心 x 切成 sqrt(N/B) 條，每條內再依中心 y 排序
+            cx = (boxes[:, 0] + boxes[:, 2]) / 2
+            cy = (boxes[:, 1] + boxes[:, 3]) / 2
+            slab = math.ceil(n / math.ceil(math.sqrt(math.ceil(n / node_size)))) or 1
+            by_x = np.argsort(cx, kind="stable")
+            slab_id = np.empty(n, dtype=np.int64)
+            slab_id[by_x] = np.arange(n) // slab
+            self.order = np.lexsort((cy, slab_id))
+        else:
+            self.order = np.empty(0, dtype=np.int64)
+        # levels[0] 是葉（依打包順序的原始外框），最後一層是根
+        self.levels = [boxes[self.order]]
+        while len(self.levels[-1]) > node_size:
+            self.levels.append(_union(self.levels[-1], node_size))
+
+    def __len__(self):
+        return len(self.order)
+
+    def search(self, min_x, min_y, max_x, max_y):
+        """與查詢框相交（含邊界接觸）的項目索引，依原始順序排序"""
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        nodes = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            b = self.levels[depth][nodes]
+            hit = (b[:, 0] <= max_x) & (b[:, 2] >= min_x) & (b[:, 1] <= max_y) & (b[:, 3] >= min_y)
+            nodes = nodes[hit]
+            if not len(nodes):
+                break
+            if depth:
+                children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+                nodes = children[children < len(self.levels[depth - 1])]
+        return np.sort(self.order[nodes])
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+跨圖磚接縫的多邊形合併
+逐張偵測時，一塊田被圖磚邊界切成好幾塊（id 為 {tx}_{ty}_{j}）；
+這裡找出在同一條圖磚接縫兩側相接的碎片，合併回一塊田
+
+- 以接縫為 key 的雜湊索引：每個碎片只登記自己貼在圖磚邊上的線段，只比對同一條接縫兩側
+- union-find 分組後，在全域像素座標上把同組碎片畫在一起再取外框
+
+用法: python seam_merge.py baxian_all_boundaries.json merged.json --zoom 19
+"""
+
+import json
+import argparse
+
+import cv2
+import numpy as np
+
+from geo import TILE_SIZE, lon_lat_to_pixels, pixels_to_lon_lat, json_default
+
+# 貼邊判斷與線段重疊的容許誤差（像素）
+EDGE_TOLERANCE = 1.5
+
+
+def edge_segments(pixels, tx, ty):
+    """
+    找出輪廓貼在圖磚四邊的線段
+    回傳 [(seam_key, side, lo, hi), ...]
+    seam_key: ('v', 接縫 x 的圖磚索引, ty) 或 ('h', tx, 接縫 y 的圖磚索引)
+    side: 0 = 接縫左/上側的圖磚, 1 = 右/下側
+    """
+    left, top = tx * TILE_SIZE, ty * TILE_SIZE
+    right, bottom = left + TILE_SIZE - 1, top + TILE_SIZE - 1
+    tol = EDGE_TOLERANCE
+
+    x0, y0 = pixels[:, 0], pixels[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    def on(a, b, v):
+        return (np.abs(a - v) <= tol) & (np.abs(b - v) <= tol)
+
+    segments = []
+    checks = (
+        (on(x0, x1, left), ("v", tx, ty), 1, y0, y1),
+        (on(x0, x1, right), ("v", tx + 1, ty), 0, y0, y1),
+        (on(y0, y1, top), ("h", tx, ty), 1, x0, x1),
+        (on(y0, y1, bottom), ("h", tx, ty + 1), 0, x0, x1),
+    )
+    for mask, key, side, a, b in checks:
+        for i in np.nonzero(mask)[0]:
+            segments.append((key, side, min(a[i], b[i]), max(a[i], b[i])))
+    return segments
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def union_polygons(rings, zoom):
+    """把同一組的碎片（全域像素座標）畫在一起，取外框轉回經緯度"""
+    allpts = np.vstack(rings)
+    ox, oy = np.floor(allpts.min(axis=0)) - 2
+    w, h = (np.ceil(allpts.max(axis=0)) - (ox, oy) + 3).astype(int)
+    canvas = np.zeros((h, w), dtype=np.uint8)
+    for ring in rings:
+        pts = np.round(ring - (ox, oy)).astype(np.int32)
+        cv2.fillPoly(canvas, [pts], 255)
+    # 接縫兩側像素的換算誤差可能留下 1px 縫隙
+    canvas = cv2.morphologyEx(canvas, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(canvas, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    merged = []
+    for c in contours:
+        if len(c) < 3:
+            continue
+        pixels = c.reshape(-1, 2).astype(np.float64) + (ox, oy)
+        coords = pixels_to_lon_lat(pixels, zoom)
+        merged.append(np.vstack([coords, coords[:1]]))
+    return merged
+
+
+def merge_seams(features, zoom):
+    """
+    合併跨圖磚接縫的碎片
+    features 需有 properties.tile = '{tx}_{ty}'；沒有 tile 的 feature 原樣保留
+    """
+    fragments = []
+    passthrough = []
+    for f in features:
+        tile = f.get("properties", {}).get("tile")
+        if not tile or f["geometry"]["type"] != "Polygon":
+            passthrough.append(f)
+            continue
+        tx, ty = (int(v) for v in tile.split("_"))
+        pixels = lon_lat_to_pixels(f["geometry"]["coordinates"][0], zoom)
+        fragments.append((f, tx, ty, pixels))
+
+    # 接縫索引：seam_key -> [(side, lo, hi, 碎片編號), ...]
+    seams = {}
+    for i, (f, tx, ty, pixels) in enumerate(fragments):
+        for key, side, lo, hi in edge_segments(pixels, tx, ty):
+            seams.setdefault(key, []).append((side, lo, hi, i))
+
+    uf = UnionFind(len(fragments))
+    for entries in seams.values():
+        a_side = [e for e in entries if e[0] == 0]
+        b_side = [e for e in entries if e[0] == 1]
+        for _, alo, ahi, ai in a_side:
+            for _, blo, bhi, bi in b_side:
+                if alo <= bhi + EDGE_TOLERANCE and blo <= ahi + EDGE_TOLERANCE:
+                    uf.union(ai, bi)
+
+    groups = {}
+    for i in range(len(fragments)):
+        groups.setdefault(uf.find(i), []).append(i)
+
+    out = []
+    for root in sorted(groups):
+        members = groups[root]
+        first = fragments[members[0]][0]
+        if len(members) == 1:
+            out.append(first)
+            continue
+
+        rings = [fragments[i][3] for i in members]
+        tiles = sorted({fragments[i][0]["properties"]["tile"] for i in members})
+        for j, coords in enumerate(union_polygons(rings, zoom)):
+            props = dict(first["properties"])
+            if j:
+                props["id"] = f"{props['id']}_{j}"
+            props["tiles"] = tiles
+            props["fragments"] = len(members)
+            out.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [coords]},
+                "properties": props
+            })
+
+    return out + passthrough
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合併跨圖磚接縫的多邊形碎片")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--zoom", type=int, default=19)
+    args = parser.parse_args()
+
+    with open(args.input, encoding="utf-8") as f:
+        geojson = json.load(f)
+
+    before = len(geojson["features"])
+    geojson["features"] = merge_seams(geojson["features"], args.zoom)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, ensure_ascii=False, default=json_default)
+
+    print(f"合併前 {before} 塊 -> 合併後 {len(geojson['features'])} 塊")
+
+
+if __name__ == "__main__":
+    main()
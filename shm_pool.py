@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+共享記憶體影像緩衝區
+主程序把影像寫進固定大小的 slot，worker process 直接讀同一塊記憶體，
+不用 pickle numpy 陣列；slot 用完才能再取得，也順便限制了排隊中的影像數
+"""
+
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 可取消的等待每隔多久檢查一次取消（秒）
+CANCEL_POLL = 0.1
+
+# worker 端：ProcessPoolExecutor 的 initializer 會設定
+_worker_shm = None
+_worker_slots = None
+
+
+class SharedImageSlots:
+    """n_slots 個 shape 大小的影像緩衝區（主程序端）"""
+
+    def __init__(self, n_slots, shape, dtype=np.uint8):
+        self.n_slots = n_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_bytes * n_slots)
+        self.slots = np.ndarray((n_slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self._free = queue.Queue()
+        for i in range(n_slots):
+            self._free.put(i)
+
+    def acquire(self, timeout=None, cancel=None):
+        """
+        取得空的 slot 編號，全部使用中就等待（逾時是 queue.Empty）
+        cancel: threading.Event，等待中被設定時回傳 None；消費端出錯時用來叫醒等 slot 的執行緒
+        """
+        if cancel is None:
+            return self._free.get(timeout=timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not cancel.is_set():
+            wait = CANCEL_POLL if deadline is None else min(CANCEL_POLL, deadline - time.monotonic())
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                return self._free.get(timeout=wait)
+            except queue.Empty:
+                pass
+        return None
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def array(self, slot):
+        return self.slots[slot]
+
+    def initargs(self):
+        """傳給 ProcessPoolExecutor(initializer=attach, initargs=...)"""
+        return (self.shm.name, self.n_slots, self.shape, self.dtype.str)
+
+    def close(self):
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(name, n_slots, shape, dtype):
+    """worker process 初始化：連上主程序的共享記憶體"""
+    global _worker_shm, _worker_slots
+    _worker_shm = shared_memory.SharedMemory(name=name)
+    # 共享記憶體由主程序負責釋放。multiprocessing 啟動的 worker（fork / spawn / forkserver）
+    # 都和主程序共用同一個 resource tracker，這裡不能取消登記，否則主程序 unlink 時 tracker 會 KeyError
+    _worker_slots = np.ndarray((n_slots,) + tuple(shape), dtype=np.dtype(dtype),
+                               buffer=_worker_shm.buf)
+
+    try:
+        import cv2
+        # 已經用多個 process 平行了，OpenCV 內部不要再開執行緒搶 CPU
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+
+
+def worker_array(slot):
+    """worker 端取得 slot 的影像（不複製）"""
+    return _worker_slots[slot]
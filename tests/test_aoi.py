@@ -0,0 +1,44 @@
+"""
+範圍的圖磚列舉：分批列舉的結果與逐張判斷一致，過大的範圍先估算就拒絕
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aoi
+from aoi import Area
+from geo import tile_bbox
+
+
+def test_tiles_match_per_tile_check(monkeypatch):
+    ring = [(121.7800, 24.6580), (121.7860, 24.6590), (121.7830, 24.6620), (121.7800, 24.6580)]
+    area = Area([[ring]])
+    # 每批只放一列，確認分批不影響結果
+    monkeypatch.setattr(aoi, "CONTAINS_BATCH", 1)
+    tiles = area.tiles(19)
+    min_x, min_y, max_x, max_y = area._tile_ranges(19)[0]
+    assert len(tiles) < area.tile_count_bound(19) == (max_x - min_x + 1) * (max_y - min_y + 1)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            west, south, east, north = tile_bbox(x, y, 19)
+            center = area.contains([((west + east) / 2, (south + north) / 2)])[0]
+            if center:
+                assert (x, y) in tiles
+    assert tiles == sorted(tiles, key=lambda t: (t[1], t[0]))
+
+
+def test_too_many_tiles_rejected_before_enumerating():
+    area = Area.from_bbox(121.0, 24.0, 122.0, 25.0)
+    assert area.tile_count_bound(19) > 2_000_000
+    with pytest.raises(ValueError, match="at most 20000"):
+        area.tiles(19, max_tiles=20000)
+
+
+def test_non_finite_coordinates_rejected():
+    with pytest.raises(ValueError):
+        Area([[[(0, 0), (np.nan, 1), (1, 1)]]])
@@ -0,0 +1,42 @@
+"""
+檢查點續跑：中斷時寫到一半的 journal / partial 尾巴要截掉，之後附加的紀錄才讀得回來
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import RunCheckpoint, JOURNAL, PARTIAL
+
+HEADER = {"zoom": 19}
+
+
+def results(i):
+    return {(i, 0): [np.array([[0.0, 0.0], [1.0, i], [0.0, 0.0]])]}
+
+
+def test_resume_after_torn_journal_line(tmp_path):
+    directory = str(tmp_path)
+    cp = RunCheckpoint(directory, HEADER)
+    cp.record("u1", results(1))
+    cp.close()
+    # 中斷在寫 u2 的途中：partial 與 journal 都只寫了一半
+    with open(os.path.join(directory, PARTIAL), "ab") as f:
+        f.write(b'{"unit":"u2","resu')
+    with open(os.path.join(directory, JOURNAL), "a", encoding="utf-8") as f:
+        f.write('{"unit": "u2", "off')
+
+    cp = RunCheckpoint(directory, HEADER, resume=True)
+    assert list(cp.completed) == ["u1"]
+    cp.record("u3", results(3))
+    cp.record("u4", results(4))
+    cp.close()
+
+    cp = RunCheckpoint(directory, HEADER, resume=True)
+    assert list(cp.completed) == ["u1", "u3", "u4"]
+    coords = cp.completed["u4"][0][(4, 0)][0]
+    assert coords.tolist() == [[0.0, 0.0], [1.0, 4.0], [0.0, 0.0]]
+    cp.close()
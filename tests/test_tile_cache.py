@@ -0,0 +1,118 @@
+"""
+圖磚快取對本機假上游的測試：命中/未命中、TTL 過期以 304 重新驗證、容量上限的 LRU 淘汰
+"""
+
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tile_cache import TileCache
+from tile_fetcher import TileFetcher
+
+TILE_BYTES = 1000
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """/{z}/{y}/{x}：每個圖磚內容不同，ETag 相同時回 304"""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_GET(self):
+        z, y, x = (int(v) for v in self.path.strip("/").split("/"))
+        etag = f'"{z}-{x}-{y}"'
+        FakeUpstream.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = f"{z}/{x}/{y}".encode().ljust(TILE_BYTES, b"\0")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    FakeUpstream.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def make_fetcher(upstream, tmp_path, **cache_args):
+    layers = {"fake": {"url": upstream + "/{z}/{y}/{x}", "headers": {}, "content_type": "image/png"}}
+    return TileFetcher(cache=TileCache(str(tmp_path), **cache_args), layers=layers)
+
+
+def test_hit_and_miss(upstream, tmp_path):
+    fetcher = make_fetcher(upstream, tmp_path)
+    entry, source = fetcher.get("fake", 19, 1, 2)
+    assert source == "miss"
+    assert entry.data.startswith(b"19/1/2")
+    entry, source = fetcher.get("fake", 19, 1, 2)
+    assert source == "hit"
+    assert len(FakeUpstream.requests) == 1
+    stats = fetcher.cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["bytes"] == TILE_BYTES
+
+
+def test_expired_tile_is_revalidated(upstream, tmp_path):
+    fetcher = make_fetcher(upstream, tmp_path, ttl=0)
+    fetcher.get("fake", 19, 1, 2)
+    entry, source = fetcher.get("fake", 19, 1, 2)
+    assert source == "revalidated"
+    assert entry.data.startswith(b"19/1/2")
+    # 第二次請求帶上第一次拿到的 ETag，上游回 304
+    assert FakeUpstream.requests[1] == ("/19/2/1", '"19-1-2"')
+    assert fetcher.cache.stats()["stale"] == 1
+
+
+def test_lru_eviction(upstream, tmp_path):
+    fetcher = make_fetcher(upstream, tmp_path, max_bytes=3 * TILE_BYTES)
+    for x in range(3):
+        fetcher.get("fake", 19, x, 0)
+    # 讀一次 x=0，最久未使用的變成 x=1
+    assert fetcher.get("fake", 19, 0, 0)[1] == "hit"
+    fetcher.get("fake", 19, 3, 0)
+
+    cache = fetcher.cache
+    assert not cache.contains("fake", 19, 1, 0)
+    assert all(cache.contains("fake", 19, x, 0) for x in (0, 2, 3))
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 3 * TILE_BYTES
+
+    # 重新開啟時由索引算出的佔用空間與執行中的累計一致
+    cache.close()
+    assert TileCache(str(tmp_path), max_bytes=3 * TILE_BYTES).stats()["bytes"] == 3 * TILE_BYTES
+
+
+def test_identical_content_counted_once(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=10 * TILE_BYTES)
+    blank = b"\0" * TILE_BYTES
+    cache.put("fake", 19, 0, 0, blank)
+    cache.put("fake", 19, 1, 0, blank)
+    assert cache.stats()["bytes"] == TILE_BYTES
+    # 改寫成不同內容後，舊內容仍被另一個圖磚使用
+    cache.put("fake", 19, 0, 0, b"\1" * TILE_BYTES)
+    assert cache.stats()["bytes"] == 2 * TILE_BYTES
+    cache.put("fake", 19, 1, 0, b"\1" * TILE_BYTES)
+    assert cache.stats()["bytes"] == TILE_BYTES
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+圖磚本機快取
+以內容雜湊 (sha256) 存放圖磚，索引以 (layer, z, x, y) 為 key，
+支援總容量上限的 LRU 淘汰、TTL 過期重新驗證與命中統計
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", "/tmp/tile_cache")
+DEFAULT_MAX_BYTES = int(os.environ.get("TILE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+DEFAULT_TTL = int(os.environ.get("TILE_CACHE_TTL", 7 * 86400))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    layer TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    modified_at REAL,
+    etag TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (layer, z, x, y)
+);
+CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed_at);
+CREATE INDEX IF NOT EXISTS tiles_digest ON tiles (digest);
+"""
+
+# 舊版索引沒有的欄位，開啟時補上
+MIGRATIONS = {
+    "modified_at": "ALTER TABLE tiles ADD COLUMN modified_at REAL",
+    "etag": "ALTER TABLE tiles ADD COLUMN etag TEXT",
+    "last_modified": "ALTER TABLE tiles ADD COLUMN last_modified TEXT",
+}
+
+
+class CacheEntry:
+    """
+    快取中的一個圖磚
+    etag / last_modified 是上游給的驗證值，modified_at 是內容最後一次改變的時間
+    """
+
+    __slots__ = ("layer", "z", "x", "y", "data", "digest", "fetched_at", "fresh",
+                 "modified_at", "etag", "last_modified")
+
+    def __init__(self, layer, z, x, y, data, digest, fetched_at, fresh,
+                 modified_at=None, etag=None, last_modified=None):
+        self.layer = layer
+        self.z = z
+        self.x = x
+        self.y = y
+        self.data = data
+        self.digest = digest
+        self.fetched_at = fetched_at
+        self.fresh = fresh
+        self.modified_at = modified_at if modified_at is not None else fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class TileCache:
+    """內容定址的圖磚快取（sqlite 索引 + 雜湊檔案）"""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"),
+                                   timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        # WAL 讓多個 worker 可同時讀
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(tiles)")}
+        for column, sql in MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(sql)
+        # 實際佔用空間（不重複內容的大小總和），開啟時算一次，之後在寫入/刪除時增減
+        self._bytes = self._total_bytes()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def get(self, layer, z, x, y):
+        """取得圖磚，不存在回傳 None；過期的圖磚回傳 fresh=False"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, fetched_at, modified_at, etag, last_modified FROM tiles "
+                "WHERE layer=? AND z=? AND x=? AND y=?",
+                (layer, z, x, y)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            digest, fetched_at, modified_at, etag, last_modified = row
+            try:
+                with open(self._blob_path(digest), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # 檔案被外部刪除，視為未命中
+                self._delete(layer, z, x, y, digest)
+                self.misses += 1
+                return None
+
+            self._db.execute(
+                "UPDATE tiles SET accessed_at=? WHERE layer=? AND z=? AND x=? AND y=?",
+                (now, layer, z, x, y))
+
+            fresh = now - fetched_at < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+
+        return CacheEntry(layer, z, x, y, data, digest, fetched_at, fresh,
+                          modified_at, etag, last_modified)
+
+    def put(self, layer, z, x, y, data, etag=None, last_modified=None):
+        """寫入圖磚（連同上游驗證值）並視需要淘汰最久未使用的圖磚"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+
+        # 相同內容（例如空白圖磚）只存一份
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        with self._lock:
+            old = self._db.execute(
+                "SELECT digest, modified_at, size FROM tiles WHERE layer=? AND z=? AND x=? AND y=?",
+                (layer, z, x, y)).fetchone()
+            stored = self._db.execute("SELECT 1 FROM tiles WHERE digest=? LIMIT 1", (digest,)).fetchone()
+            # 內容沒變就保留原本的修改時間
+            modified_at = old[1] if old and old[0] == digest and old[1] else now
+            self._db.execute(
+                "INSERT OR REPLACE INTO tiles "
+                "(layer, z, x, y, digest, size, fetched_at, accessed_at, modified_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (layer, z, x, y, digest, len(data), now, now, modified_at, etag, last_modified))
+            if stored is None:
+                self._bytes += len(data)
+            if old and old[0] != digest:
+                self._drop_blob_if_unused(old[0], old[2])
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+        return CacheEntry(layer, z, x, y, data, digest, now, True,
+                          modified_at, etag, last_modified)
+
+    def touch(self, layer, z, x, y, etag=None, last_modified=None):
+        """重新驗證成功（上游回 304），更新取得時間與驗證值"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE tiles SET fetched_at=?, accessed_at=?, "
+                "etag=COALESCE(?, etag), last_modified=COALESCE(?, last_modified) "
+                "WHERE layer=? AND z=? AND x=? AND y=?",
+                (now, now, etag, last_modified, layer, z, x, y))
+
+    def contains(self, layer, z, x, y):
+        """只檢查索引，不讀檔也不計入統計"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM tiles WHERE layer=? AND z=? AND x=? AND y=?",
+                (layer, z, x, y)).fetchone()
+        return row is not None
+
+    def _delete(self, layer, z, x, y, digest):
+        size = self._db.execute("SELECT size FROM tiles WHERE layer=? AND z=? AND x=? AND y=?",
+                                (layer, z, x, y)).fetchone()
+        self._db.execute("DELETE FROM tiles WHERE layer=? AND z=? AND x=? AND y=?", (layer, z, x, y))
+        if size is not None:
+            self._drop_blob_if_unused(digest, size[0])
+
+    def _drop_blob_if_unused(self, digest, size):
+        """沒有索引再指向這個內容時刪掉檔案並扣掉佔用空間"""
+        used = self._db.execute("SELECT 1 FROM tiles WHERE digest=? LIMIT 1", (digest,)).fetchone()
+        if used is None:
+            self._bytes -= size
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _total_bytes(self):
+        # 以不重複的內容計算實際佔用空間
+        row = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM tiles)").fetchone()
+        return row[0]
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT layer, z, x, y, digest FROM tiles ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            for layer, z, x, y, digest in rows:
+                self._delete(layer, z, x, y, digest)
+                self.evictions += 1
+                if self._bytes <= self.max_bytes:
+                    break
+
+    def stats(self):
+        """命中統計與容量"""
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+            total = self._bytes
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "tiles": count,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
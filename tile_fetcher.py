@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+上游圖磚下載 + 本機快取
+api/proxy.py 與其他工具共用
+"""
+
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+from tile_cache import TileCache
+from mbtiles import MBTilesStore
+from upstream_pool import ConnectionPool
+from singleflight import SingleFlight
+
+# 上游圖層（網址可用環境變數覆寫，方便接本機假圖磚伺服器測試）
+LAYERS = {
+    "591": {
+        "url": os.environ.get(
+            "TILE_UPSTREAM_591",
+            "https://maptiles.591.com.tw/S_Maps/wmts/DMAPS/default/GoogleMapsCompatible/{z}/{y}/{x}"),
+        "headers": {
+            "User-Agent": "Mozilla/5.0",
+            "Referer": "https://land.591.com.tw/"
+        },
+        "content_type": "image/png",
+    },
+    "esri": {
+        "url": os.environ.get(
+            "TILE_UPSTREAM_ESRI",
+            "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"),
+        "headers": {
+            "User-Agent": "OpenClaw/1.0"
+        },
+        "content_type": "image/jpeg",
+    },
+}
+
+DEFAULT_LAYER = "591"
+UPSTREAM_TIMEOUT = 5
+BROWSER_MAX_AGE = 86400
+
+
+def default_store():
+    """TILE_MBTILES='591=a.mbtiles,esri=b.mbtiles' 時改用 MBTiles 封存，否則用本機快取"""
+    spec = os.environ.get("TILE_MBTILES")
+    if spec:
+        return MBTilesStore.open(spec, readonly=os.environ.get("TILE_MBTILES_READONLY") == "1")
+    return TileCache()
+
+
+class TileNotFound(Exception):
+    """上游沒有這個圖磚"""
+
+
+class UpstreamError(Exception):
+    """上游回傳非預期的狀態碼"""
+
+
+class TileFetcher:
+    """先查快取，未命中或過期才向上游下載"""
+
+    def __init__(self, cache=None, layers=None, timeout=UPSTREAM_TIMEOUT, pool=None):
+        self.cache = cache if cache is not None else default_store()
+        self.layers = layers if layers is not None else LAYERS
+        self.timeout = timeout
+        self.pool = pool if pool is not None else ConnectionPool(timeout=timeout)
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self.flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def _download(self, layer, z, x, y, entry=None):
+        """回傳 (data, etag, last_modified)；上游回 304 時 data 為 None"""
+        conf = self.layers[layer]
+        url = conf["url"].format(z=z, x=x, y=y)
+        headers = dict(conf["headers"])
+        # 已有過期的圖磚時帶上游驗證值，內容沒變只要傳 header
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        with self._lock:
+            self.upstream_requests += 1
+        resp = self.pool.request("GET", url, headers=headers, timeout=self.timeout)
+        if resp.status == 404:
+            raise TileNotFound(f"{layer}/{z}/{x}/{y}")
+        if resp.status == 304 and entry is not None:
+            return None, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        if resp.status != 200:
+            raise UpstreamError(f"{resp.status} {url}")
+        return resp.body, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+    def get(self, layer, z, x, y):
+        """
+        回傳 (entry, source)，entry 為 CacheEntry
+        source 為 hit / miss / refresh / revalidated / stale / coalesced
+        """
+        if layer not in self.layers:
+            raise KeyError(layer)
+
+        entry = self.cache.get(layer, z, x, y)
+        if entry is not None and entry.fresh:
+            return entry, "hit"
+
+        # 同一個圖磚同時只向上游抓一次
+        (entry, source), shared = self.flight.do(
+            (layer, z, x, y), lambda: self._refresh(layer, z, x, y, entry))
+        return entry, "coalesced" if shared else source
+
+    def _refresh(self, layer, z, x, y, entry):
+        try:
+            data, etag, last_modified = self._download(layer, z, x, y, entry)
+        except TileNotFound:
+            raise
+        except Exception:
+            with self._lock:
+                self.upstream_errors += 1
+            # 上游失敗時，過期的圖磚總比沒有好
+            if entry is not None:
+                return entry, "stale"
+            raise
+
+        if data is None:
+            self.cache.touch(layer, z, x, y, etag, last_modified)
+            return entry, "revalidated"
+
+        new_entry = self.cache.put(layer, z, x, y, data, etag, last_modified)
+        return new_entry, "miss" if entry is None else "refresh"
+
+    def stats(self):
+        s = {"cache": self.cache.stats(), "pool": self.pool.stats(),
+             "flight": self.flight.stats()}
+        with self._lock:
+            s["upstream_requests"] = self.upstream_requests
+            s["upstream_errors"] = self.upstream_errors
+        return s
+
+
+def entry_validators(entry):
+    """給瀏覽器的強 ETag（內容雜湊）與 Last-Modified"""
+    etag = f'"{entry.digest[:32]}"'
+    if entry.last_modified:
+        last_modified = entry.last_modified
+    elif entry.modified_at:
+        last_modified = formatdate(entry.modified_at, usegmt=True)
+    else:
+        last_modified = None
+    return etag, last_modified
+
+
+def is_not_modified(entry, if_none_match=None, if_modified_since=None):
+    """依 If-None-Match / If-Modified-Since 判斷是否可以回 304"""
+    etag, last_modified = entry_validators(entry)
+    if if_none_match:
+        # 有 If-None-Match 時忽略 If-Modified-Since（RFC 9110）
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(entry, source=None):
+    """200 與 304 共用的快取相關 header"""
+    etag, last_modified = entry_validators(entry)
+    headers = {
+        "Cache-Control": f"public, max-age={BROWSER_MAX_AGE}",
+        "ETag": etag,
+    }
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    if source:
+        headers["X-Cache"] = source
+    return headers
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+自架用的 asyncio 圖磚代理伺服器
+與 api/proxy.py 相同介面：/api/proxy?z=&x=&y=[&layer=591|esri]
+單一程序可同時處理數百個上游請求，有並行上限、排隊上限（背壓）與優雅關閉
+
+用法: python tile_server.py --port 8080 --concurrency 256
+"""
+
+import argparse
+import asyncio
+
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
+
+from tile_cache import TileCache
+from mbtiles import MBTilesStore
+from tile_fetcher import LAYERS, DEFAULT_LAYER, UPSTREAM_TIMEOUT, cache_headers, is_not_modified
+from upstream_pool import insecure_ssl_context
+
+DEFAULT_PER_HOST = 64
+
+
+class Overloaded(Exception):
+    """上游排隊已滿"""
+
+
+class AsyncTileProxy:
+    """快取 + 並行上限 + 相同圖磚合併的非同步代理"""
+
+    def __init__(self, cache, layers=LAYERS, concurrency=256, max_pending=1024,
+                 per_host=DEFAULT_PER_HOST, timeout=UPSTREAM_TIMEOUT):
+        self.cache = cache
+        self.layers = layers
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.per_host = per_host
+        self.timeout = timeout
+
+        self.session = None
+        self._sem = asyncio.Semaphore(concurrency)
+        self._flights = {}
+        self.pending = 0
+        self.active = 0
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    async def start(self, app=None):
+        connector = TCPConnector(limit=self.concurrency, limit_per_host=self.per_host,
+                                 ssl=insecure_ssl_context(), keepalive_timeout=30)
+        self.session = ClientSession(connector=connector,
+                                     timeout=ClientTimeout(total=self.timeout))
+
+    async def close(self, app=None):
+        if self.session is not None:
+            await self.session.close()
+        self.cache.close()
+
+    async def _download(self, layer, z, x, y, entry=None):
+        """回傳 (status, data, etag, last_modified)"""
+        conf = self.layers[layer]
+        url = conf["url"].format(z=z, x=x, y=y)
+        headers = dict(conf["headers"])
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        self.pending += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.pending -= 1
+
+        self.active += 1
+        self.upstream_requests += 1
+        try:
+            async with self.session.get(url, headers=headers) as resp:
+                etag = resp.headers.get("ETag")
+                last_modified = resp.headers.get("Last-Modified")
+                if resp.status in (304, 404):
+                    return resp.status, None, etag, last_modified
+                resp.raise_for_status()
+                return resp.status, await resp.read(), etag, last_modified
+        finally:
+            self.active -= 1
+            self._sem.release()
+
+    async def _refresh(self, layer, z, x, y, entry):
+        try:
+            status, data, etag, last_modified = await self._download(layer, z, x, y, entry)
+        except Exception:
+            self.upstream_errors += 1
+            # 上游失敗時，過期的圖磚總比沒有好
+            if entry is not None:
+                return entry, "stale"
+            raise
+        if status == 404:
+            return None, "missing"
+        if status == 304 and entry is not None:
+            await asyncio.to_thread(self.cache.touch, layer, z, x, y, etag, last_modified)
+            return entry, "revalidated"
+        if data is None:
+            raise ValueError(f"unexpected {status} for {layer}/{z}/{x}/{y}")
+        new_entry = await asyncio.to_thread(self.cache.put, layer, z, x, y, data, etag, last_modified)
+        return new_entry, "miss" if entry is None else "refresh"
+
+    async def get(self, layer, z, x, y):
+        """回傳 (entry, source)；上游沒有這個圖磚時 entry 為 None"""
+        # 快取讀取會拿鎖、查 sqlite、讀檔，放到執行緒以免卡住 event loop
+        entry = await asyncio.to_thread(self.cache.get, layer, z, x, y)
+        if entry is not None and entry.fresh:
+            return entry, "hit"
+
+        key = (layer, z, x, y)
+        fut = self._flights.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            entry, _ = await asyncio.shield(fut)
+            return entry, "coalesced"
+
+        # 背壓：排隊太長就請瀏覽器稍後再試，而不是無限堆積
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded()
+
+        fut = asyncio.get_running_loop().create_future()
+        self._flights[key] = fut
+        try:
+            result = await self._refresh(layer, z, x, y, entry)
+        except BaseException as e:
+            fut.set_exception(e)
+            # 沒人等的話避免 "exception never retrieved" 警告
+            fut.exception()
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+    def stats(self):
+        return {
+            "cache": self.cache.stats(),
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "in_flight": len(self._flights),
+            "upstream_requests": self.upstream_requests,
+            "upstream_errors": self.upstream_errors,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
+
+
+async def handle_proxy(request):
+    proxy = request.app["proxy"]
+    params = request.query
+
+    if params.get("stats"):
+        return web.json_response(proxy.stats(), headers={"Cache-Control": "no-store"})
+
+    z = params.get("z", "")
+    x = params.get("x", "")
+    y = params.get("y", "")
+    layer = params.get("layer", DEFAULT_LAYER)
+
+    if not (z.isdigit() and x.isdigit() and y.isdigit()) or layer not in proxy.layers:
+        return web.Response(status=400, text="Missing params")
+
+    try:
+        entry, source = await proxy.get(layer, int(z), int(x), int(y))
+    except Overloaded:
+        return web.Response(status=503, headers={"Retry-After": "1"})
+    except asyncio.CancelledError:
+        # 這個請求本身被取消（連線中斷）才往上丟；
+        # 只是合併等待的領頭請求被取消時，回 503 讓瀏覽器重試
+        if asyncio.current_task().cancelling():
+            raise
+        return web.Response(status=503, headers={"Retry-After": "1"})
+    except Exception:
+        return web.Response(status=404)
+
+    if entry is None:
+        return web.Response(status=404)
+
+    headers = cache_headers(entry, source)
+    # 瀏覽器已經有這個圖磚，只回 header
+    if is_not_modified(entry, request.headers.get("If-None-Match"),
+                       request.headers.get("If-Modified-Since")):
+        return web.Response(status=304, headers=headers)
+
+    headers["Content-type"] = proxy.layers[layer]["content_type"]
+    return web.Response(body=entry.data, headers=headers)
+
+
+def make_app(proxy):
+    app = web.Application()
+    app["proxy"] = proxy
+    app.router.add_get("/api/proxy", handle_proxy)
+    app.on_startup.append(proxy.start)
+    app.on_cleanup.append(proxy.close)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="asyncio 圖磚代理伺服器")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--mbtiles", default=None, help="改用 MBTiles 封存，例如 591=591.mbtiles,esri=esri.mbtiles")
+    parser.add_argument("--readonly", action="store_true", help="MBTiles 唯讀（離線、多個 worker 共用）")
+    parser.add_argument("--concurrency", type=int, default=256, help="同時進行的上游請求上限")
+    parser.add_argument("--max-pending", type=int, default=1024, help="排隊上限，超過回 503")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="每個上游主機的連線上限")
+    parser.add_argument("--grace", type=float, default=10, help="關閉時等待進行中請求的秒數")
+    args = parser.parse_args()
+
+    if args.mbtiles:
+        cache = MBTilesStore.open(args.mbtiles, readonly=args.readonly)
+    else:
+        cache = TileCache(args.cache_dir) if args.cache_dir else TileCache()
+    proxy = AsyncTileProxy(cache, concurrency=args.concurrency,
+                           max_pending=args.max_pending, per_host=args.per_host)
+
+    print(f"🌐 圖磚代理啟動: http://{args.host}:{args.port}/api/proxy")
+    # run_app 收到 SIGINT/SIGTERM 會停止接新連線，等進行中的請求完成再關閉
+    web.run_app(make_app(proxy), host=args.host, port=args.port,
+                shutdown_timeout=args.grace, print=None)
+    print("已關閉")
+
+
+if __name__ == "__main__":
+    main()
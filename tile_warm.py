@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+圖磚預先下載（暖快取）
+出田前把範圍內各縮放層級的 591 地籍圖與 ESRI 衛星圖先抓進代理快取
+已在快取中的圖磚會跳過，中斷後重跑即可續傳
+
+用法: python tile_warm.py --zoom 17-20 --layers 591,esri --rate 20
+"""
+
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tile_cache import TileCache
+from mbtiles import MBTilesStore
+from tile_fetcher import TileFetcher, TileNotFound, LAYERS
+from rate_limit import TokenBucket
+from geo import lat_lon_to_tile
+
+# 八仙段範圍（與 detect_baxian_full.py 相同）
+MIN_LAT = 24.6538
+MAX_LAT = 24.6660
+MIN_LON = 121.7770
+MAX_LON = 121.7935
+
+
+def enumerate_tiles(min_lat, max_lat, min_lon, max_lon, zooms, layers):
+    """列出範圍內所有 (layer, z, x, y)"""
+    tiles = []
+    for z in zooms:
+        min_tx, min_ty = lat_lon_to_tile(max_lat, min_lon, z)
+        max_tx, max_ty = lat_lon_to_tile(min_lat, max_lon, z)
+        for layer in layers:
+            for y in range(min_ty, max_ty + 1):
+                for x in range(min_tx, max_tx + 1):
+                    tiles.append((layer, z, x, y))
+    return tiles
+
+
+def parse_zoom(text):
+    """'19' 或 '17-20'"""
+    if "-" in text:
+        lo, hi = text.split("-", 1)
+        return list(range(int(lo), int(hi) + 1))
+    return [int(text)]
+
+
+def warm(fetcher, tiles, workers=8, rate=20, refresh=False):
+    """下載圖磚進快取，回傳統計"""
+    bucket = TokenBucket(rate)
+    result = {"fetched": 0, "skipped": 0, "missing": 0, "failed": 0, "bytes": 0}
+
+    # 續傳：已經在快取的就不用再抓
+    if refresh:
+        todo = tiles
+    else:
+        todo = [t for t in tiles if not fetcher.cache.contains(*t)]
+        result["skipped"] = len(tiles) - len(todo)
+
+    def fetch(tile):
+        bucket.acquire()
+        try:
+            entry, source = fetcher.get(*tile)
+        except TileNotFound:
+            return "missing", 0
+        except Exception as e:
+            print(f"下載失敗 {tile}: {e}")
+            return "failed", 0
+        if source in ("hit", "coalesced", "revalidated"):
+            return "skipped", 0
+        return "fetched", len(entry.data)
+
+    start = time.time()
+    total = len(todo)
+    print(f"共 {len(tiles)} 個圖磚，已快取 {result['skipped']}，需下載 {total}")
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(fetch, t) for t in todo]
+        for i, fut in enumerate(as_completed(futures), 1):
+            status, size = fut.result()
+            result[status] += 1
+            result["bytes"] += size
+            if i % 100 == 0 or i == total:
+                elapsed = time.time() - start
+                print(f"[{i}/{total}] {i / elapsed:.1f} 圖磚/秒, "
+                      f"{result['bytes'] / 1024 / elapsed:.1f} KB/秒")
+
+    result["seconds"] = time.time() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="預先下載範圍內的圖磚到代理快取")
+    parser.add_argument("--min-lat", type=float, default=MIN_LAT)
+    parser.add_argument("--max-lat", type=float, default=MAX_LAT)
+    parser.add_argument("--min-lon", type=float, default=MIN_LON)
+    parser.add_argument("--max-lon", type=float, default=MAX_LON)
+    parser.add_argument("--zoom", default="17-19", help="縮放層級，例如 19 或 17-20")
+    parser.add_argument("--layers", default="591,esri", help=f"圖層: {','.join(LAYERS)}")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=20, help="每秒最多幾個請求（0 = 不限）")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--mbtiles", default=None, help="寫入 MBTiles 封存，例如 591=591.mbtiles,esri=esri.mbtiles")
+    parser.add_argument("--refresh", action="store_true", help="已快取的圖磚也檢查，過期的重新下載")
+    args = parser.parse_args()
+
+    layers = args.layers.split(",")
+    for layer in layers:
+        if layer not in LAYERS:
+            parser.error(f"未知圖層: {layer}")
+
+    zooms = parse_zoom(args.zoom)
+    if args.mbtiles:
+        cache = MBTilesStore.open(args.mbtiles)
+        for layer, archive in cache.archives.items():
+            archive.set_metadata(
+                name=layer, type="baselayer", version="1",
+                format="png" if LAYERS[layer]["content_type"] == "image/png" else "jpg",
+                bounds=f"{args.min_lon},{args.min_lat},{args.max_lon},{args.max_lat}",
+                minzoom=min(zooms), maxzoom=max(zooms))
+        missing = [layer for layer in layers if layer not in cache.archives]
+        if missing:
+            parser.error(f"--mbtiles 沒有指定圖層: {','.join(missing)}")
+    else:
+        cache = TileCache(args.cache_dir) if args.cache_dir else TileCache()
+    fetcher = TileFetcher(cache)
+
+    print("=== 圖磚預先下載 ===")
+    print(f"範圍: lat {args.min_lat:.4f}~{args.max_lat:.4f}, lon {args.min_lon:.4f}~{args.max_lon:.4f}")
+
+    tiles = enumerate_tiles(args.min_lat, args.max_lat, args.min_lon, args.max_lon,
+                            zooms, layers)
+    result = warm(fetcher, tiles, workers=args.workers, rate=args.rate, refresh=args.refresh)
+    cache.close()
+
+    seconds = max(result["seconds"], 1e-9)
+    print(f"\n完成！")
+    print(f"下載: {result['fetched']} 個, {result['bytes'] / 1024 / 1024:.2f} MB")
+    print(f"跳過（已快取）: {result['skipped']}, 上游沒有: {result['missing']}, 失敗: {result['failed']}")
+    print(f"耗時: {seconds:.1f} 秒, {result['fetched'] / seconds:.1f} 圖磚/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+上游 HTTP 連線池
+keep-alive 重複使用 TLS 連線，SSL context 只建立一次，
+可設定總連線數與每個主機的連線上限，並提供使用率統計
+"""
+
+import os
+import ssl
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get("TILE_POOL_SIZE", 32))
+DEFAULT_MAX_PER_HOST = int(os.environ.get("TILE_POOL_PER_HOST", 8))
+
+# 連線被對方關閉時，重用的舊連線會丟這些例外，換新連線重試一次
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                ConnectionResetError, BrokenPipeError)
+
+
+class PoolTimeout(Exception):
+    """等不到可用的連線"""
+
+
+class PooledResponse:
+    """已讀完內容的回應（連線已歸還）"""
+
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def insecure_ssl_context():
+    """上游憑證有問題，關閉驗證"""
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class ConnectionPool:
+    """執行緒安全的 keep-alive 連線池"""
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, max_per_host=DEFAULT_MAX_PER_HOST,
+                 timeout=5, ssl_context=None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl_context if ssl_context is not None else insecure_ssl_context()
+
+        self._cond = threading.Condition()
+        self._idle = {}      # key -> [conn, ...]
+        self._in_use = {}    # key -> 使用中的連線數
+        self._total_in_use = 0
+
+        self.created = 0
+        self.reused = 0
+        self.requests = 0
+        self.waits = 0
+        self.closed = 0
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout,
+                                               context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _idle_count(self):
+        return sum(len(v) for v in self._idle.values())
+
+    def _acquire(self, key, wait_timeout):
+        deadline = time.monotonic() + wait_timeout
+        with self._cond:
+            waited = False
+            while (self._in_use.get(key, 0) >= self.max_per_host
+                   or self._total_in_use >= self.max_connections):
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"{key[1]}:{key[2]}")
+                self._cond.wait(remaining)
+
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            self._total_in_use += 1
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.created += 1
+
+        return self._new_connection(key), False
+
+    def _release(self, key, conn, reusable):
+        to_close = []
+        with self._cond:
+            self._in_use[key] -= 1
+            self._total_in_use -= 1
+            if reusable:
+                idle = self._idle.setdefault(key, [])
+                idle.append(conn)
+                if len(idle) > self.max_per_host:
+                    to_close.append(idle.pop(0))
+                # 總開啟數超過上限時，關掉閒置最多的主機上最舊的連線
+                while self._idle_count() + self._total_in_use > self.max_connections:
+                    victim = max(self._idle, key=lambda k: len(self._idle[k]))
+                    to_close.append(self._idle[victim].pop(0))
+            else:
+                to_close.append(conn)
+            self.closed += len(to_close)
+            self._cond.notify()
+
+        for c in to_close:
+            c.close()
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        """送出請求並讀完回應內容"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._cond:
+            self.requests += 1
+
+        for attempt in range(2):
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except STALE_ERRORS:
+                self._release(key, conn, False)
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self._release(key, conn, False)
+                raise
+
+            self._release(key, conn, not resp.will_close)
+            return PooledResponse(resp.status, resp.headers, data)
+
+    def stats(self):
+        """連線池使用率"""
+        with self._cond:
+            hosts = {}
+            for key in set(self._idle) | set(self._in_use):
+                hosts[f"{key[1]}:{key[2]}"] = {
+                    "in_use": self._in_use.get(key, 0),
+                    "idle": len(self._idle.get(key, [])),
+                }
+            return {
+                "max_connections": self.max_connections,
+                "max_per_host": self.max_per_host,
+                "in_use": self._total_in_use,
+                "idle": self._idle_count(),
+                "utilization": self._total_in_use / self.max_connections,
+                "requests": self.requests,
+                "created": self.created,
+                "reused": self.reused,
+                "closed": self.closed,
+                "waits": self.waits,
+                "hosts": hosts,
+            }
+
+    def close(self):
+        with self._cond:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for c in conns:
+            c.close()